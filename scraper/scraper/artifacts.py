@@ -0,0 +1,77 @@
+# Debug artifacts (screenshots and HTML snapshots) for Playwright pages
+#
+# Pages are only captured when something went wrong (extraction failed, the
+# fallback selectors ran, the page never became ready) or when they are
+# picked by DEBUG_ARTIFACTS_SAMPLE_RATE. The directory works as a ring
+# buffer: once it holds DEBUG_ARTIFACTS_MAX captures the oldest are deleted.
+import asyncio
+import os
+import random
+import time
+import uuid
+from collections import deque
+
+
+class ArtifactStore:
+    def __init__(self, directory, max_artifacts=200, sample_rate=0.0, full_page=False, stats=None):
+        self.directory = directory
+        self.max_artifacts = max_artifacts
+        self.sample_rate = sample_rate
+        self.full_page = full_page
+        self.stats = stats
+        os.makedirs(directory, exist_ok=True)
+        # Pick up captures from earlier runs so the bound holds across runs
+        existing = {}
+        for name in os.listdir(directory):
+            prefix = name.rsplit(".", 1)[0]
+            path = os.path.join(directory, name)
+            existing.setdefault(prefix, []).append(path)
+        ordered = sorted(existing.values(), key=lambda paths: min(os.path.getmtime(p) for p in paths))
+        self._captures = deque(ordered)
+
+    @classmethod
+    def from_settings(cls, settings, stats=None):
+        return cls(
+            settings.get("DEBUG_ARTIFACTS_DIR", "debug_artifacts"),
+            max_artifacts=settings.getint("DEBUG_ARTIFACTS_MAX", 200),
+            sample_rate=settings.getfloat("DEBUG_ARTIFACTS_SAMPLE_RATE", 0.0),
+            full_page=settings.getbool("DEBUG_ARTIFACTS_FULL_PAGE", False),
+            stats=stats,
+        )
+
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def capture(self, page, label, reason):
+        # Screenshot plus HTML of the page as it is now. Never raises: a
+        # broken page shouldn't turn a debug aid into another failure.
+        if page is None or page.is_closed():
+            return None
+        prefix = f"{time.strftime('%Y%m%d-%H%M%S')}_{reason}_{label}_{uuid.uuid4().hex[:8]}"
+        paths = []
+        try:
+            screenshot = await page.screenshot(full_page=self.full_page, type="jpeg", quality=60)
+            html = await page.content()
+        except Exception:
+            if self.stats is not None:
+                self.stats.inc_value("debug_artifacts/capture_failed")
+            return None
+        for suffix, data in ((".jpg", screenshot), (".html", html.encode("utf-8"))):
+            path = os.path.join(self.directory, prefix + suffix)
+            await asyncio.to_thread(_write, path, data)
+            paths.append(path)
+        self._captures.append(paths)
+        while len(self._captures) > self.max_artifacts:
+            for path in self._captures.popleft():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        if self.stats is not None:
+            self.stats.inc_value(f"debug_artifacts/{reason}")
+        return paths
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
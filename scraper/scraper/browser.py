@@ -0,0 +1,530 @@
+# Helpers for the Playwright pages used by the spiders
+#
+# Pages opt into these through request meta, the same way they select a
+# Playwright context.
+import os
+import random
+import time
+
+from scrapy import signals
+from scrapy_playwright.page import PageMethod
+
+# Hosts and URL fragments of analytics, ads and tag managers. None of these
+# carry data we read, they only cost bandwidth and main-thread time.
+BLOCKED_URL_PATTERNS = (
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googleadservices.com",
+    "doubleclick.net",
+    "facebook.net",
+    "facebook.com/tr",
+    "connect.facebook",
+    "adobedtm.com",
+    "omtrdc.net",
+    "demdex.net",
+    "everesttech.net",
+    "hotjar.com",
+    "bat.bing.com",
+    "analytics.tiktok.com",
+    "criteo.com",
+    "criteo.net",
+    "qualtrics.com",
+    "clarity.ms",
+    "newrelic.com",
+    "nr-data.net",
+    "quantummetric.com",
+    "tealiumiq.com",
+    "/b/ss/",
+)
+
+# Named route-interception profiles. "resource_types" are Playwright resource
+# types that are always aborted, "patterns" are matched against the URL.
+RESOURCE_PROFILES = {
+    # Everything loads, for debugging
+    "full": {
+        "resource_types": (),
+        "patterns": (),
+    },
+    # The page still renders its layout, but without media or tracking
+    "render-minimal": {
+        "resource_types": ("image", "media", "font"),
+        "patterns": BLOCKED_URL_PATTERNS,
+    },
+    # Only the document, scripts and XHR/fetch calls, for pages that are read
+    # from their JSON traffic or DOM and never looked at
+    "data-only": {
+        "resource_types": ("image", "media", "font", "stylesheet", "texttrack", "manifest", "eventsource", "websocket"),
+        "patterns": BLOCKED_URL_PATTERNS,
+    },
+}
+
+
+class ResourceBlocker:
+    # Installed as `playwright_page_init_callback`, so the route is in place
+    # before the page navigates. The profile comes from the request's
+    # "resource_profile" meta key, falling back to PLAYWRIGHT_RESOURCE_PROFILE.
+    #
+    # scrapy-playwright runs the callback for every request, pooled pages
+    # that are reused included, and puts its own route in front each time.
+    # A page gets one route and one response listener: on reuse the route is
+    # only moved back in front of scrapy-playwright's.
+    def __init__(self, settings, stats=None):
+        self.stats = stats
+        self.default_profile = settings.get("PLAYWRIGHT_RESOURCE_PROFILE", "full")
+        self.profiles = dict(RESOURCE_PROFILES)
+        self.profiles.update(settings.getdict("PLAYWRIGHT_RESOURCE_PROFILES"))
+        self._routes = {}
+
+    async def init_page(self, page, request):
+        name = request.meta.get("resource_profile", self.default_profile)
+        profile = self.profiles[name]
+        first_sight = page not in self._routes
+        handler = self._routes.get(page)
+        if handler is not None:
+            await page.unroute("**/*", handler)
+        if profile["resource_types"] or profile["patterns"]:
+            handler = self._route_handler(name, profile)
+            await page.route("**/*", handler)
+        self._routes[page] = handler
+        if first_sight:
+            page.on("response", self._response_handler(name))
+            page.on("close", lambda _: self._routes.pop(page, None))
+
+    def _route_handler(self, name, profile):
+        resource_types = frozenset(profile["resource_types"])
+        patterns = tuple(profile["patterns"])
+
+        async def handle(route, request):
+            if request.resource_type in resource_types:
+                self._inc(f"playwright/blocked/{name}/resource_type/{request.resource_type}")
+                await route.abort()
+            elif any(pattern in request.url for pattern in patterns):
+                self._inc(f"playwright/blocked/{name}/pattern")
+                await route.abort()
+            else:
+                # Let scrapy-playwright's own route handler take it from here
+                await route.fallback()
+
+        return handle
+
+    def _response_handler(self, name):
+        # Bytes of the responses let through (when the server sends a
+        # content-length). Aborted requests never get a response, so the
+        # bytes blocking saves aren't measured here; only the blocked counts
+        # above are.
+        def handle(response):
+            length = response.headers.get("content-length")
+            if length and length.isdigit():
+                self._inc(f"playwright/allowed_bytes/{name}", int(length))
+
+        return handle
+
+    def _inc(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
+
+
+# Runs inside the page: resolves once the readiness condition holds and the
+# page has been quiet on the network and in the DOM for the configured
+# windows, or when the hard ceiling is hit
+READINESS_JS = """
+async ({selector, predicate, networkQuietMs, domSettleMs, timeoutMs, scroll}) => {
+    const start = performance.now();
+    let lastNetwork = start;
+    let lastMutation = start;
+    const resources = new PerformanceObserver(() => { lastNetwork = performance.now(); });
+    resources.observe({type: "resource"});
+    const mutations = new MutationObserver(() => { lastMutation = performance.now(); });
+    mutations.observe(document, {subtree: true, childList: true, characterData: true});
+    const check = predicate ? new Function("return (" + predicate + ");") : null;
+    if (scroll && document.body) {
+        window.scrollTo(0, document.body.scrollHeight);
+    }
+    return await new Promise((resolve) => {
+        const poll = () => {
+            const now = performance.now();
+            let present = true;
+            if (selector) {
+                present = document.querySelector(selector) !== null;
+            }
+            if (present && check) {
+                try { present = !!check(); } catch (e) { present = false; }
+            }
+            const quiet = now - lastNetwork >= networkQuietMs && now - lastMutation >= domSettleMs;
+            const timedOut = now - start >= timeoutMs;
+            if ((present && quiet) || timedOut) {
+                resources.disconnect();
+                mutations.disconnect();
+                resolve({ready: present, timedOut: timedOut && !(present && quiet), elapsedMs: now - start});
+            } else {
+                setTimeout(poll, 50);
+            }
+        };
+        poll();
+    });
+}
+"""
+
+# Upper bounds (ms) of the time-to-ready buckets kept in the stats
+READINESS_BUCKETS = (250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+class PageReadiness:
+    # Replaces fixed wait_for_timeout sleeps: returns as soon as `selector`
+    # is attached and/or the JS `predicate` expression is truthy, and the
+    # network and DOM have settled. `timeout_ms` is the hard ceiling; hitting
+    # it doesn't fail the request, the callback decides what to do with a
+    # page that never became ready.
+    def __init__(self, selector=None, predicate=None, network_quiet_ms=500, dom_settle_ms=300, timeout_ms=30000, scroll=True):
+        self.options = {
+            "selector": selector,
+            "predicate": predicate,
+            "networkQuietMs": network_quiet_ms,
+            "domSettleMs": dom_settle_ms,
+            "timeoutMs": timeout_ms,
+            "scroll": scroll,
+        }
+
+    @classmethod
+    def from_settings(cls, settings, **kwargs):
+        kwargs.setdefault("network_quiet_ms", settings.getint("PLAYWRIGHT_READY_NETWORK_QUIET_MS", 500))
+        kwargs.setdefault("dom_settle_ms", settings.getint("PLAYWRIGHT_READY_DOM_SETTLE_MS", 300))
+        kwargs.setdefault("timeout_ms", settings.getint("PLAYWRIGHT_READY_TIMEOUT_MS", 30000))
+        return cls(**kwargs)
+
+    def page_method(self):
+        return PageMethod("evaluate", READINESS_JS, self.options)
+
+
+def record_readiness(response, page_type, stats):
+    # Time-to-ready per page type, as a count/total/max plus histogram buckets
+    result = None
+    for method in response.meta.get("playwright_page_methods", []):
+        if method.method == "evaluate" and method.args and method.args[0] == READINESS_JS:
+            result = method.result
+    if not result:
+        return None
+    elapsed = int(result["elapsedMs"])
+    prefix = f"playwright/ready/{page_type}"
+    stats.inc_value(f"{prefix}/count")
+    stats.inc_value(f"{prefix}/total_ms", elapsed)
+    stats.max_value(f"{prefix}/max_ms", elapsed)
+    bucket = next((f"le_{bound}ms" for bound in READINESS_BUCKETS if elapsed <= bound), "inf")
+    stats.inc_value(f"{prefix}/{bucket}")
+    if result["timedOut"]:
+        stats.inc_value(f"{prefix}/timed_out")
+    return result
+
+
+def browser_rss_mb():
+    # Resident memory of every process spawned by this one (the browser and
+    # its renderer processes). Reads /proc, so it is 0 on other platforms.
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return 0
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    children = {}
+    rss = {}
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        pid = int(entry)
+        children.setdefault(int(fields[1]), []).append(pid)
+        rss[pid] = int(fields[21]) * page_size
+    total = 0
+    pending = list(children.get(os.getpid(), []))
+    while pending:
+        pid = pending.pop()
+        total += rss.get(pid, 0)
+        pending.extend(children.get(pid, []))
+    return total // (1024 * 1024)
+
+
+class PooledPage:
+    def __init__(self, pool, context):
+        self.pool = pool
+        self.context = context
+        self.navigations = 0
+        self.checked_out = time.monotonic()
+
+
+class PagePool:
+    # Keeps warm pages per pool name ("page_pool" meta key) and hands them to
+    # later requests through scrapy-playwright's "playwright_page" meta key.
+    # Contexts are named "<pool>-<generation>-<slot>"; retiring a generation
+    # makes new pages go to fresh contexts while the old ones drain and close.
+    #
+    # Requests opt in with meta={"page_pool": name, "playwright_include_page":
+    # True, "playwright_page_init_callback": pool.init_page} and hand the page
+    # back with `await pool.release(page, request)` instead of closing it.
+    # Pages that are never handed back (e.g. a failure that didn't carry
+    # "playwright_page") are closed by `reap()` after PLAYWRIGHT_POOL_PAGE_TTL.
+    def __init__(self, settings, stats=None, init_page=None):
+        self.stats = stats
+        self.init_callback = init_page
+        self.idle_pages = settings.getint("PLAYWRIGHT_POOL_IDLE_PAGES", 4)
+        self.contexts = settings.getint("PLAYWRIGHT_POOL_CONTEXTS", 2)
+        self.max_navigations = settings.getint("PLAYWRIGHT_POOL_MAX_NAVIGATIONS", 50)
+        self.max_context_navigations = settings.getint("PLAYWRIGHT_POOL_MAX_CONTEXT_NAVIGATIONS", 500)
+        self.max_rss_mb = settings.getint("PLAYWRIGHT_POOL_MAX_RSS_MB", 0)
+        self.page_ttl = settings.getfloat("PLAYWRIGHT_POOL_PAGE_TTL", 300)
+        self._idle = {}
+        self._pages = {}
+        self._generation = {}
+        self._slot = {}
+        self._context_navigations = {}
+
+    def checkout(self, request):
+        # Called by PagePoolMiddleware when the request reaches the downloader,
+        # so requests still in the scheduler never hold a page. Downloader
+        # middlewares run before the request waits for its download slot, so
+        # one queued there does hold its page until the slot frees up.
+        pool = request.meta["page_pool"]
+        idle = self._idle.get(pool, [])
+        while idle:
+            page = idle.pop()
+            state = self._pages.get(page)
+            if state is None or page.is_closed() or self._retired(state):
+                continue
+            state.checked_out = time.monotonic()
+            request.meta["playwright_page"] = page
+            request.meta["playwright_context"] = state.context
+            self._inc("pool/pages_reused")
+            return
+        request.meta["playwright_context"] = self._next_context(pool)
+
+    async def init_page(self, page, request):
+        # scrapy-playwright calls this for every request, so a reused page
+        # keeps its state (navigation count included); only the wrapped
+        # callback runs again, and it is idempotent per page
+        if page not in self._pages:
+            self._pages[page] = PooledPage(request.meta["page_pool"], request.meta["playwright_context"])
+            page.on("close", lambda _: self._pages.pop(page, None))
+            self._inc("pool/pages_created")
+        if self.init_callback is not None:
+            await self.init_callback(page, request)
+
+    async def release(self, page, request, reuse=True):
+        state = self._pages.get(page)
+        if state is None:
+            if not page.is_closed():
+                await page.close()
+            return
+        # Handlers are attached again on every request that uses the page
+        for event, handler in request.meta.get("playwright_page_event_handlers", {}).items():
+            if callable(handler):
+                try:
+                    page.remove_listener(event, handler)
+                except Exception:
+                    pass
+        state.navigations += 1
+        context_navigations = self._context_navigations.get(state.context, 0) + 1
+        self._context_navigations[state.context] = context_navigations
+        if context_navigations >= self.max_context_navigations:
+            self._retire(state.pool)
+        if self.max_rss_mb and browser_rss_mb() >= self.max_rss_mb:
+            self._inc("pool/rss_ceiling_hit")
+            for pool in list(self._generation):
+                self._retire(pool)
+            await self._close_idle()
+        idle = self._idle.setdefault(state.pool, [])
+        if (
+            reuse
+            and not page.is_closed()
+            and state.navigations < self.max_navigations
+            and not self._retired(state)
+            and len(idle) < self.idle_pages
+        ):
+            idle.append(page)
+            return
+        self._inc("pool/pages_recycled")
+        await self._close(page)
+
+    async def reap(self):
+        # Closes pages checked out for longer than the TTL; they belong to
+        # requests whose callback or errback never handed them back
+        now = time.monotonic()
+        idle = {page for pages in self._idle.values() for page in pages}
+        for page, state in list(self._pages.items()):
+            if page not in idle and now - state.checked_out > self.page_ttl:
+                self._inc("pool/pages_reaped")
+                await self._close(page)
+
+    async def close(self):
+        for page in list(self._pages):
+            await self._close(page)
+        self._idle.clear()
+
+    def _next_context(self, pool):
+        generation = self._generation.setdefault(pool, 0)
+        slot = self._slot.get(pool, 0)
+        self._slot[pool] = (slot + 1) % self.contexts
+        return f"{pool}-{generation}-{slot}"
+
+    def _retired(self, state):
+        return not state.context.startswith(f"{state.pool}-{self._generation.get(state.pool, 0)}-")
+
+    def _retire(self, pool):
+        self._generation[pool] = self._generation.get(pool, 0) + 1
+        self._inc("pool/generations_retired")
+
+    async def _close_idle(self):
+        for pages in self._idle.values():
+            while pages:
+                await self._close(pages.pop())
+
+    async def _close(self, page):
+        state = self._pages.pop(page, None)
+        if not page.is_closed():
+            await page.close()
+        # Close a retired context once its last page is gone
+        if state is not None and self._retired(state):
+            if not any(other.context == state.context for other in self._pages.values()):
+                self._context_navigations.pop(state.context, None)
+                try:
+                    await page.context.close()
+                except Exception:
+                    pass
+                self._inc("pool/contexts_closed")
+
+    def _inc(self, key, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
+
+
+class LaunchProfileAddon:
+    # Applies the PLAYWRIGHT_LAUNCH_PROFILE entry of PLAYWRIGHT_LAUNCH_PROFILES.
+    # Profiles with "screenshots" capture debug artifacts for every page.
+    # Add-on priority sits below project and spider settings, so an explicit
+    # PLAYWRIGHT_LAUNCH_OPTIONS anywhere still wins.
+    def update_settings(self, settings):
+        name = settings.get("PLAYWRIGHT_LAUNCH_PROFILE")
+        profiles = settings.getdict("PLAYWRIGHT_LAUNCH_PROFILES")
+        if name not in profiles:
+            raise ValueError(f"Unknown PLAYWRIGHT_LAUNCH_PROFILE {name!r}, expected one of {sorted(profiles)}")
+        profile = profiles[name]
+        settings.set("PLAYWRIGHT_LAUNCH_OPTIONS", profile["launch_options"], priority="addon")
+        if profile.get("screenshots"):
+            settings.set("DEBUG_ARTIFACTS_SAMPLE_RATE", 1.0, priority="addon")
+
+
+class LaunchProfileStats:
+    # Records startup time (spider open to first Playwright response, which
+    # includes the browser launch) and per-page time under the name of the
+    # active launch profile, so runs with different profiles can be compared
+    # from their stats. A page is timed from the moment its request reaches
+    # the downloader to its response; the handler's download_latency isn't
+    # relied on.
+    def __init__(self, stats, profile):
+        self.stats = stats
+        self.prefix = f"playwright/profile/{profile}"
+        self.profile = profile
+        self.opened = None
+        self.started = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        ext = cls(crawler.stats, crawler.settings.get("PLAYWRIGHT_LAUNCH_PROFILE"))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.request_reached_downloader, signal=signals.request_reached_downloader)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+        self.opened = time.monotonic()
+        self.stats.set_value("playwright/launch_profile", self.profile)
+
+    def request_reached_downloader(self, request, spider):
+        if request.meta.get("playwright"):
+            request.meta["_profile_page_started"] = time.monotonic()
+
+    def response_received(self, response, request, spider):
+        if not request.meta.get("playwright"):
+            return
+        now = time.monotonic()
+        if not self.started:
+            self.started = True
+            self.stats.set_value(f"{self.prefix}/startup_ms", int((now - self.opened) * 1000))
+        started = request.meta.pop("_profile_page_started", None)
+        if started is not None:
+            elapsed = int((now - started) * 1000)
+            self.stats.inc_value(f"{self.prefix}/page_count")
+            self.stats.inc_value(f"{self.prefix}/page_ms_total", elapsed)
+            self.stats.max_value(f"{self.prefix}/page_ms_max", elapsed)
+
+    def spider_closed(self, spider):
+        count = self.stats.get_value(f"{self.prefix}/page_count")
+        if count:
+            self.stats.set_value(f"{self.prefix}/page_ms_avg", self.stats.get_value(f"{self.prefix}/page_ms_total") // count)
+
+
+class PageInstrumentation:
+    # Browser event handlers for `playwright_page_event_handlers`. Only the
+    # events listed in PLAYWRIGHT_INSTRUMENT_EVENTS get a handler; each one
+    # aggregates counts, bytes and timings per resource type into the stats,
+    # and only a PLAYWRIGHT_INSTRUMENT_LOG_SAMPLE_RATE share of events is
+    # logged in detail. The same bound methods are handed out for every page,
+    # so nothing is allocated per request.
+    def __init__(self, settings, stats, logger):
+        self.stats = stats
+        self.logger = logger
+        self.sample_rate = settings.getfloat("PLAYWRIGHT_INSTRUMENT_LOG_SAMPLE_RATE", 0.0)
+        handlers = {
+            "console": self.on_console,
+            "pageerror": self.on_pageerror,
+            "request": self.on_request,
+            "response": self.on_response,
+            "requestfinished": self.on_requestfinished,
+            "requestfailed": self.on_requestfailed,
+        }
+        events = settings.getlist("PLAYWRIGHT_INSTRUMENT_EVENTS", ["pageerror", "requestfailed", "response"])
+        self.handlers = {event: handlers[event] for event in events}
+
+    def event_handlers(self):
+        return dict(self.handlers)
+
+    def _sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def on_console(self, message):
+        self.stats.inc_value(f"playwright/events/console/{message.type}")
+        if self._sampled():
+            self.logger.info("Console: %s", message.text)
+
+    def on_pageerror(self, error):
+        self.stats.inc_value("playwright/events/pageerror")
+        if self._sampled():
+            self.logger.error("Page error: %s", error)
+
+    def on_request(self, request):
+        self.stats.inc_value(f"playwright/events/request/{request.resource_type}")
+        if self._sampled():
+            self.logger.debug("Request: %s", request.url)
+
+    def on_response(self, response):
+        resource_type = response.request.resource_type
+        self.stats.inc_value(f"playwright/events/response/{resource_type}/{response.status // 100}xx")
+        length = response.headers.get("content-length")
+        if length and length.isdigit():
+            self.stats.inc_value(f"playwright/events/response_bytes/{resource_type}", int(length))
+        if self._sampled():
+            self.logger.debug("Response: %s %s", response.url, response.status)
+
+    def on_requestfinished(self, request):
+        # Timings are relative to the request start, -1 when not available
+        timing = request.timing
+        if timing.get("responseEnd", -1) >= 0:
+            self.stats.inc_value(f"playwright/events/finished/{request.resource_type}")
+            self.stats.inc_value(f"playwright/events/finished_ms/{request.resource_type}", int(timing["responseEnd"]))
+
+    def on_requestfailed(self, request):
+        self.stats.inc_value(f"playwright/events/requestfailed/{request.resource_type}")
+        if self._sampled():
+            self.logger.warning("Request failed: %s %s", request.url, request.failure)
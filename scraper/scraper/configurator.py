@@ -0,0 +1,319 @@
+# Shared helpers for the Chevrolet configurator pages
+#
+# The exterior/interior/options pages only depend on
+# bodyType/year/model/bodyStyle, so every trim of a model renders the exact
+# same three pages. The cache below makes sure each of those page sets is
+# loaded once and shared by all trims that need it.
+import asyncio
+import json
+
+CONFIGURATOR_URL = "https://www.chevrolet.com/shopping/configurator/{bodyType}/{year}/{model}/{bodyStyle}/{stage}?buildCode=&radius=250&zipCode=48243"
+
+# Fields filled in from the configurator pages, keyed by page
+STAGE_FIELDS = {
+    "exterior": "exteriorColors",
+    "interior": "interiorColors",
+    "options": "packages",
+}
+
+# Element the page renders once the options of a page are in the DOM
+STAGE_SELECTORS = {
+    "exterior": "div.configuratorControlPanelSectionOptionsV1_optionsContainer__wkZjs",
+    "interior": "div.configuratorControlPanelSectionOptionsV1_optionsContainer__wkZjs",
+    "options": "div#packages_options",
+}
+
+# The configurator SPA loads its data from this backend
+GATEWAY_MARKER = "aec-cp-configurator-gateway"
+
+# Keys the configurator JSON keeps the option list of each page under. Only
+# a list sitting directly under one of them counts, a key that merely
+# mentions the page (e.g. "exteriorImages") doesn't
+STAGE_JSON_KEYS = {
+    "exterior": ("exteriorcolors", "paints", "paintcolors"),
+    "interior": ("interiorcolors", "interiors", "seattrims"),
+    "options": ("packages",),
+}
+
+# Every entry of an option list has a name and at least one of these, which
+# tells an option from e.g. a list of image or navigation links
+STAGE_JSON_DETAILS = {
+    "exterior": ("msrp", "price", "pricing", "imageUrl", "image", "swatchUrl", "thumbnailUrl"),
+    "interior": ("msrp", "price", "pricing", "imageUrl", "image", "swatchUrl", "thumbnailUrl"),
+    "options": ("msrp", "price", "pricing", "features", "items", "options", "contents"),
+}
+
+
+def configurator_key(model):
+    return (model.bodyType, model.year, model.model, model.bodyStyle)
+
+
+def configurator_url(key, stage):
+    bodyType, year, model, bodyStyle = key
+    return CONFIGURATOR_URL.format(bodyType=bodyType, year=year, model=model, bodyStyle=bodyStyle, stage=stage)
+
+
+class ConfiguratorPages:
+    def __init__(self, key):
+        self.key = key
+        self.data = {field: [] for field in STAGE_FIELDS.values()}
+        self.waiters = []
+        self.pending = set(STAGE_FIELDS)
+        self.done = False
+
+
+class ConfiguratorPageCache:
+    def __init__(self, stats=None):
+        self.stats = stats
+        self._entries = {}
+
+    def claim(self, model):
+        # Returns (entry, owner). The owner is the first trim asking for a key
+        # and is responsible for loading the pages; later trims either get the
+        # finished data right away or wait on the in-flight load.
+        key = configurator_key(model)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = ConfiguratorPages(key)
+            entry.waiters.append(model)
+            self._inc("miss")
+            return entry, True
+        if entry.done:
+            self._inc("hit")
+            return entry, False
+        entry.waiters.append(model)
+        self._inc("coalesced")
+        return entry, False
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def stage_done(self, key, stage, data=None):
+        # Records one page's data (None when it failed) and tells whether
+        # that was the last page the model was waiting for
+        entry = self._entries[key]
+        if data is not None:
+            entry.data[STAGE_FIELDS[stage]] = data
+        entry.pending.discard(stage)
+        return not entry.pending and not entry.done
+
+    def resolve(self, key):
+        # Marks the pages as loaded and hands back every trim that was waiting
+        entry = self._entries[key]
+        entry.done = True
+        waiters, entry.waiters = entry.waiters, []
+        return entry, waiters
+
+    def _inc(self, name):
+        if self.stats is not None:
+            self.stats.inc_value(f"configurator/page_cache/{name}")
+
+
+class ConfiguratorCapture:
+    # Records the gateway JSON responses a configurator page fetches for
+    # itself, so the callback can build colors and packages without waiting
+    # for the SPA to render them. `forward` is called with every response
+    # first, so the capture can take the place of another response handler.
+    def __init__(self, marker=GATEWAY_MARKER, forward=None):
+        self.marker = marker
+        self.forward = forward
+        self.payloads = []
+        self._received = asyncio.Event()
+
+    async def on_response(self, response):
+        if self.forward is not None:
+            self.forward(response)
+        if self.marker not in response.url or response.request.resource_type not in ("xhr", "fetch"):
+            return
+        if "json" not in response.headers.get("content-type", ""):
+            return
+        try:
+            payload = await response.json()
+        except Exception:
+            return
+        self.payloads.append(payload)
+        self._received.set()
+
+    async def wait(self, timeout, settle=0.5):
+        # Wait for the first payload, then until the page stops fetching more
+        # for `settle` seconds, never longer than `timeout` overall
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            await asyncio.wait_for(self._received.wait(), timeout)
+        except asyncio.TimeoutError:
+            return
+        while True:
+            count = len(self.payloads)
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(settle, remaining))
+            if len(self.payloads) == count:
+                return
+
+
+def extract_embedded_state(response):
+    # JSON state the server renders into the page (e.g. the Next.js data blob)
+    states = []
+    for text in response.xpath('//script[@id="__NEXT_DATA__" or @type="application/json"]/text()').getall():
+        try:
+            states.append(json.loads(text))
+        except ValueError:
+            continue
+    return states
+
+
+def extract_from_json(payloads, stage):
+    # Builds the same records the DOM extraction produces from configurator
+    # JSON, whether captured from the gateway or embedded in the page. A
+    # payload without an option list of the expected shape gives nothing
+    records = []
+    seen = set()
+    for payload in payloads:
+        for entries in _find_option_lists(payload, stage):
+            for entry in entries:
+                record = _package_record(entry) if stage == "options" else _color_record(entry)
+                marker = record.get("name") or record.get("title")
+                if marker in seen:
+                    continue
+                seen.add(marker)
+                records.append(record)
+    return records
+
+
+def _find_option_lists(node, stage):
+    # Yields every option list of the page, at any depth
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key.lower() in STAGE_JSON_KEYS[stage] and _is_option_list(value, stage):
+                yield value
+            else:
+                yield from _find_option_lists(value, stage)
+    elif isinstance(node, list):
+        for entry in node:
+            yield from _find_option_lists(entry, stage)
+
+
+def _is_option_list(node, stage):
+    if not isinstance(node, list) or not node:
+        return False
+    details = STAGE_JSON_DETAILS[stage]
+    return all(
+        isinstance(entry, dict)
+        and _first(entry, ("name", "title", "displayName"))
+        and any(entry.get(key) not in (None, "") for key in details)
+        for entry in node
+    )
+
+
+def _first(entry, keys, default=""):
+    for key in keys:
+        value = entry.get(key)
+        if value not in (None, ""):
+            return value
+    return default
+
+
+def _price(entry):
+    value = _first(entry, ("msrp", "price", "pricing"), "No price")
+    if isinstance(value, dict):
+        value = _first(value, ("value", "amount", "formattedValue", "displayValue"), "No price")
+    return str(value)
+
+
+def _image(entry):
+    value = _first(entry, ("imageUrl", "image", "swatchUrl", "thumbnailUrl"), "No image")
+    if isinstance(value, dict):
+        value = _first(value, ("url", "src"), "No image")
+    return value
+
+
+def _color_record(entry):
+    name = _first(entry, ("name", "title", "displayName"))
+    if not name:
+        return None
+    return {"image_url": _image(entry), "name": str(name).strip(), "price": _price(entry)}
+
+
+def _package_record(entry):
+    title = _first(entry, ("title", "name", "displayName"))
+    if not title:
+        return None
+    options = []
+    items = _first(entry, ("features", "items", "options", "contents"), [])
+    for item in items if isinstance(items, list) else []:
+        if isinstance(item, dict):
+            item = _first(item, ("name", "title", "description"))
+        if item:
+            options.append(str(item).strip())
+    return {"title": str(title).strip(), "options": options, "price": _price(entry)}
+
+
+# scrapy-playwright serialises the page with page.content() for the response
+# body once the page methods have run. Swapping the rendered document for an
+# empty one as the last page method keeps that body tiny; the callback puts
+# the document back before it reads the page
+DETACH_DOCUMENT_JS = """
+() => {
+    window.__configuratorDocument = document.documentElement;
+    document.replaceChild(document.createElement("html"), document.documentElement);
+}
+"""
+
+RESTORE_DOCUMENT_JS = """
+() => {
+    const detached = window.__configuratorDocument;
+    if (detached) {
+        document.replaceChild(detached, document.documentElement);
+        delete window.__configuratorDocument;
+    }
+}
+"""
+
+# Runs inside the page and collects the same records as the spider's CSS
+# extraction, so only the compact result crosses back to Python instead of
+# the serialised DOM
+EXTRACT_JS = """
+({stage}) => {
+    const text = (root, selector, fallback) => {
+        const element = root.querySelector(selector);
+        const value = element ? element.textContent.trim() : "";
+        return value || fallback;
+    };
+    const records = [];
+    if (stage === "options") {
+        const packages = document.querySelectorAll("#packages_options div.drp-grid-item");
+        if (packages.length) {
+            for (const pkg of packages) {
+                records.push({
+                    title: text(pkg, "h6", "No title"),
+                    options: Array.from(pkg.querySelectorAll("ul li div"), (el) => el.textContent.trim()),
+                    price: text(pkg, "p.configuratorProductCardFooterPricing_breakWord__nWBHl", "No price"),
+                });
+            }
+            return {records, fallback: false};
+        }
+        for (const element of document.querySelectorAll("div[class*='options']")) {
+            records.push({title: text(element, "h6", "No title"), price: text(element, "p[class*='pricing']", "No price")});
+        }
+        return {records, fallback: true};
+    }
+    const container = "div.configuratorControlPanelSectionOptionsV1_optionsContainer__wkZjs";
+    if (document.querySelector(container)) {
+        for (const option of document.querySelectorAll(container + " div.configuratorControlPanelSectionOptionV1_container__tKC_W")) {
+            const image = option.querySelector("div.productImageV1_imageContainer__otCnJ img");
+            records.push({
+                image_url: (image && image.getAttribute("src")) || "No image",
+                name: text(option, "p.configuratorControlPanelSectionOptionV1_title__C78__", "No name"),
+                price: text(option, "div.imageSwatchPricing_pricing__HzkIR", "No price"),
+            });
+        }
+        return {records, fallback: false};
+    }
+    for (const element of document.querySelectorAll("div[class*='optionsContainer']")) {
+        records.push({name: text(element, "p[class*='title']", "No name"), price: text(element, "div[class*='pricing']", "No price")});
+    }
+    return {records, fallback: true};
+}
+"""
@@ -0,0 +1,290 @@
+# Vehicle cards of DDC (Dealer.com) inventory pages
+#
+# Every card is read with a handful of precompiled XPath expressions that
+# are all relative to the card, so a page costs the same per vehicle however
+# many vehicles it lists. The spec list (<dt>Engine</dt><dd>...</dd>) is
+# turned into one label -> value map per card instead of one lookup per
+# field.
+#
+# Most DDC sites also serve the same inventory as JSON from the widget API,
+# in pages of up to DDC_JSON_PAGE_SIZE vehicles, which is far cheaper than
+# the HTML. JsonInventorySource builds the same records the HTML path does;
+# FastPathState remembers per dealer which of the two works.
+#
+# Benchmark against the per-field parsel lookups on generated pages (from
+# the directory holding scrapy.cfg):
+#
+#     python -m scraper.ddc
+import json
+import os
+import sys
+import timeit
+from urllib.parse import urlencode, urljoin, urlparse
+
+from lxml import etree, html
+
+from scraper.decoding import loads
+from scraper.items import DealerListing
+
+_CARDS = etree.XPath('//ul[contains(@class, "inventoryList")]/li[contains(@class, "item")]')
+_HPRODUCT = etree.XPath('./div[contains(@class, "hproduct")]')
+_PRICE = etree.XPath('.//span[contains(@class, "final-price")]/span[@class="value"]/text()')
+_IMAGE = etree.XPath('.//div[@class="media"]/a/img')
+_LINK = etree.XPath('.//a[@class="url"]/@href')
+_SPEC_TERMS = etree.XPath('.//div[@class="description"]//dt')
+
+
+class VehicleCard:
+    __slots__ = ("data", "price", "image", "link", "specs")
+
+    def __init__(self, data, price, image, link, specs):
+        self.data = data
+        self.price = price
+        self.image = image
+        self.link = link
+        self.specs = specs
+
+    def spec(self, label, default=None):
+        # Value of the first spec whose label contains `label`
+        for term, value in self.specs.items():
+            if label in term:
+                return value
+        return default
+
+
+def _text(element):
+    return (element.text or "").strip()
+
+
+def read_card(item):
+    hproduct = _HPRODUCT(item)
+    if not hproduct:
+        return None
+    hproduct = hproduct[0]
+    # data-make, data-vin, ... without the prefix
+    data = {name[5:]: value for name, value in hproduct.attrib.items() if name.startswith("data-")}
+    price = _PRICE(hproduct)
+    images = _IMAGE(hproduct)
+    image = (images[0].get("data-src") or images[0].get("src")) if images else None
+    link = _LINK(hproduct)
+    specs = {}
+    for term in _SPEC_TERMS(hproduct):
+        value = term.getnext()
+        while value is not None and value.tag != "dd":
+            value = value.getnext()
+        label = _text(term)
+        if value is not None and label not in specs:
+            specs[label] = _text(value)
+    return VehicleCard(data, price[0] if price else None, image, link[0] if link else None, specs)
+
+
+def read_cards(root):
+    # `root` is the lxml root of the page, e.g. response.selector.root
+    cards = []
+    for item in _CARDS(root):
+        card = read_card(item)
+        if card is not None:
+            cards.append(card)
+    return cards
+
+
+def match_vehicles(cards, vehicles, stats=None):
+    # Pairs every card with its DDC.dataLayer vehicle by VIN. List positions
+    # are only trusted when neither the cards nor the data layer carry VINs;
+    # otherwise a card without a match gets {} instead of another vehicle's
+    # data, and is counted under ddc/vin/unmatched
+    by_vin = {vehicle.get("vin"): vehicle for vehicle in vehicles if isinstance(vehicle, dict) and vehicle.get("vin")}
+    positional = not by_vin and not any(card.data.get("vin") for card in cards)
+    pairs = []
+    for index, card in enumerate(cards):
+        if positional:
+            vehicle = vehicles[index] if index < len(vehicles) and isinstance(vehicles[index], dict) else {}
+        else:
+            vehicle = by_vin.get(card.data.get("vin"))
+            if vehicle is None:
+                vehicle = {}
+                if stats is not None:
+                    stats.inc_value("ddc/vin/unmatched")
+        pairs.append((card, vehicle))
+    return pairs
+
+
+class FastPathState:
+    # Dealer host -> "json" or "html", kept in a small JSON file so later
+    # runs go straight to the source that worked
+    def __init__(self, path=None):
+        self.path = path
+        self.sources = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.sources = json.load(f)
+
+    def get(self, dealer):
+        return self.sources.get(dealer)
+
+    def set(self, dealer, source):
+        self.sources[dealer] = source
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.sources, f, indent=1, sort_keys=True)
+
+
+def dealer_of(url):
+    return urlparse(url).netloc.replace("www.", "")
+
+
+class JsonInventorySource:
+    ENDPOINT = "/apis/widget/INVENTORY_LISTING_DEFAULT_AUTO_NEW:inventory-data-bus1/getInventory"
+
+    def __init__(self, endpoint=ENDPOINT, page_size=100):
+        self.endpoint = endpoint
+        self.page_size = page_size
+
+    def url(self, inventory_url, start=0):
+        parsed = urlparse(inventory_url)
+        query = urlencode({"start": start, "pageSize": self.page_size})
+        return f"{parsed.scheme}://{parsed.netloc}{self.endpoint}?{query}"
+
+    def page_urls(self, inventory_url, total):
+        # URLs of the pages after the first
+        return [self.url(inventory_url, start) for start in range(self.page_size, total, self.page_size)]
+
+    def parse(self, body):
+        # Returns (vehicles, total count), or None when the body isn't an
+        # inventory payload (the dealer doesn't have the API)
+        try:
+            payload = loads(body)
+        except ValueError:
+            return None
+        if not isinstance(payload, dict) or not isinstance(payload.get("inventory"), list):
+            return None
+        page_info = payload.get("pageInfo") or {}
+        total = page_info.get("totalCount", len(payload["inventory"]))
+        return payload["inventory"], int(total or 0)
+
+    def record(self, vehicle, page_url):
+        # Same fields as ScrapyExclusiveSpider.get_data
+        attributes = _attributes(vehicle.get("attributes"))
+        tracking = vehicle.get("trackingData") or {}
+        mpg = (attributes.get("fuelEconomy") or attributes.get("mpg") or "").split("/")
+        images = vehicle.get("images") or []
+        image = images[0].get("uri") if images and isinstance(images[0], dict) else None
+        doors = tracking.get("doors", vehicle.get("doors", ""))
+        if doors is None or doors == "null":
+            doors = ""
+        parsed = urlparse(page_url)
+        trim = vehicle.get("trim")
+        return DealerListing(
+            Make=vehicle.get("make"),
+            Model=vehicle.get("model"),
+            Trim=trim,
+            Year=str(vehicle.get("year")),
+            VIN=vehicle.get("vin"),
+            MSRP=_price(vehicle.get("pricing") or {}),
+            FuelType=tracking.get("normalFuelType", vehicle.get("fuelType", "")),
+            BodyStyle=vehicle.get("bodyStyle"),
+            Engine=attributes.get("engine"),
+            Transmission=attributes.get("transmission"),
+            ExteriorColor=attributes.get("exteriorColor"),
+            ExteriorColorGeneric="",
+            InteriorColor=attributes.get("interiorColor"),
+            InteriorColorGeneric="",
+            DriveTrain=attributes.get("driveLine") or "",
+            NumberOfDoors=str(doors),
+            CityMPG=mpg[0].strip() if mpg[0] else "",
+            HighwayMPG=mpg[1].strip() if len(mpg) > 1 else "",
+            Features=tracking.get("features", ""),
+            Image=image,
+            Link=urljoin(f"{parsed.scheme}://{parsed.netloc}", vehicle.get("link") or ""),
+            Source=parsed.netloc.replace("www.", ""),
+            CollectedFrom="JSON DDC Inventory",
+            Style=trim,
+        )
+
+
+def _attributes(attributes):
+    values = {}
+    for attribute in attributes or []:
+        if isinstance(attribute, dict) and attribute.get("name"):
+            values.setdefault(attribute["name"], attribute.get("value") or attribute.get("labeledValue"))
+    return values
+
+
+def _price(pricing):
+    # Final price if the dealer shows one, else the retail price, with the
+    # same formatting as the HTML path ("$31,005" -> "31005")
+    value = pricing.get("retailPrice") or ""
+    for price in pricing.get("dprice") or []:
+        if isinstance(price, dict) and price.get("isFinalPrice"):
+            value = price.get("value") or value
+    return str(value).replace("$", "").replace(",", "")
+
+
+# Benchmark
+
+_CARD_HTML = """
+<li class="item">
+  <div class="hproduct" data-make="Chevrolet" data-model="Equinox" data-trim="LT {n}" data-year="2025"
+       data-vin="VIN{n:014d}" data-bodystyle="SUV" data-exteriorcolor="Summit White">
+    <div class="media"><a href="#"><img data-src="https://example.com/{n}.jpg" src="x.gif"></a></div>
+    <span class="price final-price"><span class="value">$31,{n:03d}</span></span>
+    <div class="description"><dl>
+      <dt>Engine:</dt><dd>1.5L Turbo</dd>
+      <dt>Transmission:</dt><dd>Automatic</dd>
+      <dt>MPG Range:</dt><dd>26/31</dd>
+      <dt>Drive Line:</dt><dd>FWD</dd>
+      <dt>Interior Color:</dt><dd>Jet Black</dd>
+      <dt>Stock #:</dt><dd>S{n}</dd>
+    </dl></div>
+    <a class="url" href="/new/Chevrolet/2025-Chevrolet-Equinox-{n}.htm">Details</a>
+  </div>
+</li>
+"""
+
+
+def _sample_page(vehicles):
+    cards = "".join(_CARD_HTML.format(n=n) for n in range(vehicles))
+    return f'<html><body><ul class="inventoryList">{cards}</ul><div class="footer">{"<p>x</p>" * 200}</div></body></html>'
+
+
+def _parsel_fields(text):
+    # The lookups the spider used to make per vehicle, absolute // included
+    from parsel import Selector
+
+    selector = Selector(text=text)
+    for vehicle in selector.xpath('//ul[contains(@class, "inventoryList")]/li[contains(@class, "item")]'):
+        hproduct = vehicle.xpath('./div[contains(@class, "hproduct")]')
+        for name in ("make", "model", "trim", "year", "vin", "bodystyle", "exteriorcolor"):
+            hproduct.xpath(f"./@data-{name}").get()
+        hproduct.xpath('.//div[@class="media"]/a/img/@data-src').get()
+        hproduct.xpath('.//span[contains(@class, "final-price")]/span[@class="value"]/text()').get()
+        hproduct.xpath('.//span[contains(@class, "final-price")]/span[@class="value"]/text()').get()
+        description = hproduct.xpath('.//div[@class="description"]')
+        for label in ("Engine", "Transmission", "MPG Range", "MPG Range", "Drive Line", "Interior Color"):
+            description.xpath(f'//dt[contains(.,"{label}")]/following-sibling::dd/text()').get()
+        hproduct.xpath('//a[@class="url"]/@href').get()
+
+
+def _compiled_fields(text):
+    for card in read_cards(html.fromstring(text)):
+        for label in ("Engine", "Transmission", "MPG Range", "Drive Line", "Interior Color"):
+            card.spec(label)
+
+
+def main(argv=None):
+    number = 5
+    for vehicles in (25, 50, 100, 200):
+        text = _sample_page(vehicles)
+        before = timeit.timeit(lambda: _parsel_fields(text), number=number) / number * 1000
+        after = timeit.timeit(lambda: _compiled_fields(text), number=number) / number * 1000
+        print(f"{vehicles:4} vehicles  per-field xpath {before:8.1f} ms ({before / vehicles:.3f}/vehicle)  "
+              f"compiled {after:7.1f} ms ({after / vehicles:.3f}/vehicle)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
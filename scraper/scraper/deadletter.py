@@ -0,0 +1,153 @@
+# Dead-letter queue for requests that failed for good
+#
+# Every failed request is stored in full (method, headers, body, callback,
+# errback, cb_kwargs and whatever meta can be serialised) together with
+# spider-specific context, one JSON line per failure in
+# DEAD_LETTER_DIR/<spider>_<time>_<pid>.jsonl, so processes started in the
+# same second (shard workers) never share a file. Lines are buffered and
+# appended DEAD_LETTER_BUFFER at a time, and on close.
+#
+# A run over only those requests:
+#
+#     scrapy crawl toyota -a replay=output/dead_letters/toyota_2025-06-01_02-00-00_4242.jsonl
+#
+# Spiders can override replay_requests(letters) when a request can't be
+# sent again as it is (see ChevySpider).
+import base64
+import json
+import os
+import time
+
+from scrapy import signals
+from scrapy.utils.request import request_from_dict
+
+from scraper.items import RECORD_TYPES, Record
+
+# Meta set by the engine and middlewares while a request runs, not part of
+# the request itself
+RUNTIME_META = {"download_slot", "download_latency", "retry_times", "depth", "download_timeout"}
+
+
+class DeadLetterQueue:
+    def __init__(self, path, buffer_size=50, stats=None, logger=None):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.stats = stats
+        self.logger = logger
+        self._buffer = []
+        self.count = 0
+
+    @classmethod
+    def from_crawler(cls, crawler, spider):
+        settings = crawler.settings
+        directory = settings.get("DEAD_LETTER_DIR", "output/dead_letters")
+        path = os.path.join(directory, f"{spider.name}_{time.strftime('%Y-%m-%d_%H-%M-%S')}_{os.getpid()}.jsonl")
+        queue = cls(path, settings.getint("DEAD_LETTER_BUFFER", 50), crawler.stats, spider.logger)
+        crawler.signals.connect(queue.close, signal=signals.spider_closed)
+        return queue
+
+    def add(self, request, spider, reason, context=None):
+        letter = {
+            "time": time.time(),
+            "reason": reason,
+            "request": _encode(_serialisable_request(request, spider)),
+        }
+        if context:
+            letter["context"] = _encode(context)
+        self._buffer.append(json.dumps(letter))
+        self.count += 1
+        if self.stats is not None:
+            self.stats.inc_value("dead_letters/count")
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(self._buffer) + "\n")
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+        if self.count and self.logger is not None:
+            self.logger.warning(f"{self.count} failed requests written to {self.path}, replay with -a replay={self.path}")
+
+
+def _serialisable_request(request, spider):
+    data = request.to_dict(spider=spider)
+    meta = {}
+    for key, value in data.get("meta", {}).items():
+        if key in RUNTIME_META or key.startswith("_"):
+            continue
+        try:
+            json.dumps(_encode(value))
+        except (TypeError, ValueError):
+            # Pages, page methods, handlers... rebuilt by the spider on replay
+            continue
+        meta[key] = value
+    data["meta"] = meta
+    return data
+
+
+def _encode(value):
+    # JSON has no bytes, tuples or records, so they are tagged and restored
+    # by _decode
+    if isinstance(value, Record):
+        return {"__record__": type(value).__name__, "fields": _encode(value.asdict())}
+    if isinstance(value, bytes):
+        try:
+            return {"__bytes__": value.decode("utf-8")}
+        except UnicodeDecodeError:
+            return {"__base64__": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, tuple):
+        return {"__tuple__": [_encode(v) for v in value]}
+    if isinstance(value, dict):
+        return {str(k) if not isinstance(k, bytes) else k.decode("latin-1"): _encode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if "__bytes__" in value:
+            return value["__bytes__"].encode("utf-8")
+        if "__base64__" in value:
+            return base64.b64decode(value["__base64__"])
+        if "__tuple__" in value:
+            return tuple(_decode(v) for v in value["__tuple__"])
+        if "__record__" in value:
+            return RECORD_TYPES[value["__record__"]](**_decode(value["fields"]))
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def read_letters(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                letter = json.loads(line)
+                letter["request"] = _decode(letter["request"])
+                letter["context"] = _decode(letter.get("context") or {})
+                yield letter
+
+
+def letter_request(letter, spider):
+    # The stored request, let through even if the dupefilter saw its URL
+    request = request_from_dict(letter["request"], spider=spider)
+    return request.replace(dont_filter=True)
+
+
+def replay_requests(path, spider):
+    # Requests of a dead-letter file, through the spider's own hook if it has one
+    letters = read_letters(path)
+    hook = getattr(spider, "replay_requests", None)
+    if hook is not None:
+        yield from hook(letters)
+    else:
+        for letter in letters:
+            yield letter_request(letter, spider)
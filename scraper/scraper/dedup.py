@@ -0,0 +1,130 @@
+# Keys already emitted, within a run or across runs
+#
+# A Bloom filter in memory answers "never seen" for almost every new key
+# without touching the disk; only a possible hit is confirmed against the
+# exact index, an SQLite table next to it. With DEDUP_PERSIST both live in
+# DEDUP_DIR/<spider>.sqlite and .bloom, so a key emitted in an earlier run is
+# still known. Keys older than DEDUP_TTL_DAYS are let through again and
+# their timestamp refreshed. Persisting needs a positive TTL: without one a
+# key emitted once would be left out of every later export for good.
+#
+# SQLite commits as it goes but the filter is only written on close, so the
+# filter file records how many keys the table held when it was saved; after
+# a crash the table holds more and the filter is rebuilt from it, otherwise
+# keys added since would be missed.
+import hashlib
+import math
+import os
+import sqlite3
+import struct
+import time
+
+_MAGIC = b"BLM2"
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001, bits=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing on one digest instead of k separate hashes
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def save(self, path, keys=0):
+        # `keys` is the number of keys the filter was built from
+        with open(path, "wb") as f:
+            f.write(_MAGIC + struct.pack("<QQdQ", self.size, self.capacity, self.error_rate, keys))
+            f.write(self.bits)
+
+    @classmethod
+    def load(cls, path, capacity, error_rate, keys=0):
+        # None when the file is missing, was built with other parameters or
+        # from another number of keys
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            header = f.read(len(_MAGIC) + 32)
+            if header[:len(_MAGIC)] != _MAGIC or len(header) != len(_MAGIC) + 32:
+                return None
+            size, stored_capacity, stored_error_rate, stored_keys = struct.unpack("<QQdQ", header[len(_MAGIC):])
+            if (stored_capacity, stored_error_rate, stored_keys) != (capacity, error_rate, keys):
+                return None
+            bloom = cls(capacity, error_rate, bytearray(f.read()))
+        return bloom if bloom.size == size and len(bloom.bits) == (size + 7) // 8 else None
+
+
+class DedupIndex:
+    def __init__(self, path=None, capacity=1000000, error_rate=0.001, ttl=0, commit_every=1000):
+        # Without a path the index only lives for the run
+        self.path = path
+        self.ttl = ttl
+        self.commit_every = commit_every
+        self._pending = 0
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(f"{path}.sqlite" if path else ":memory:")
+        self.db.execute("CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY, source TEXT, seen_at REAL)")
+        self.bloom = BloomFilter.load(f"{path}.bloom", capacity, error_rate, self._keys()) if path else None
+        if self.bloom is None:
+            self.bloom = BloomFilter(capacity, error_rate)
+            for (key,) in self.db.execute("SELECT key FROM seen"):
+                self.bloom.add(key)
+
+    @classmethod
+    def from_settings(cls, settings, name):
+        directory = settings.get("DEDUP_DIR", "output/dedup")
+        persist = settings.getbool("DEDUP_PERSIST", False)
+        ttl = settings.getfloat("DEDUP_TTL_DAYS", 0) * 86400
+        if persist and ttl <= 0:
+            raise ValueError("DEDUP_PERSIST needs a positive DEDUP_TTL_DAYS")
+        return cls(
+            os.path.join(directory, name) if persist else None,
+            capacity=settings.getint("DEDUP_CAPACITY", 1000000),
+            error_rate=settings.getfloat("DEDUP_ERROR_RATE", 0.001),
+            ttl=ttl,
+        )
+
+    def seen(self, key):
+        if key not in self.bloom:
+            return False
+        row = self.db.execute("SELECT seen_at FROM seen WHERE key = ?", (key,)).fetchone()
+        return row is not None and (not self.ttl or time.time() - row[0] < self.ttl)
+
+    def add(self, key, source=""):
+        self.db.execute("INSERT OR REPLACE INTO seen VALUES (?, ?, ?)", (key, source, time.time()))
+        self.bloom.add(key)
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.db.commit()
+            self._pending = 0
+
+    def check_and_add(self, key, source=""):
+        # True when `key` was already emitted, otherwise records it
+        if self.seen(key):
+            return True
+        self.add(key, source)
+        return False
+
+    def _keys(self):
+        return self.db.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+    def close(self):
+        self.db.commit()
+        if self.path:
+            self.bloom.save(f"{self.path}.bloom", self._keys())
+        self.db.close()
@@ -0,0 +1,221 @@
+# Batched writers behind ColumnarExportPipeline
+#
+# Rows are buffered column by column and written EXPORT_BATCH_SIZE at a
+# time, with a fixed schema (the field list) per spider. Parquet is used when
+# pyarrow is installed: every column is a string column, and the repetitive
+# ones (make, model, colors, dealer...) are dictionary-encoded, so each
+# distinct value is stored once per row group. Without pyarrow the batches go
+# to CsvBatchWriter, which quotes the way csv.writer does, unlike joining
+# values with commas.
+#
+# Benchmark on synthetic rows (from the directory holding scrapy.cfg):
+#
+#     python -m scraper.export --rows 1000000
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def cell(value, json_cache=None):
+    # Lists/dicts (colors, packages...) are stored as JSON, None as "".
+    # Trims share their colors/packages objects, so with a cache each one is
+    # serialised once; the cache holds the object too, so its id can't be
+    # reused while the entry lives.
+    if value is None:
+        return ""
+    if isinstance(value, (list, dict)):
+        if json_cache is None:
+            return json.dumps(value)
+        cached = json_cache.get(id(value))
+        if cached is None or cached[0] is not value:
+            cached = json_cache[id(value)] = (value, json.dumps(value))
+        return cached[1]
+    return str(value)
+
+
+class CsvBatchWriter:
+    # Same output as csv.writer (minimal quoting, \r\n line ends), but each
+    # distinct value is quoted once per batch: the shared JSON blobs are long
+    # and full of quotes, and csv.writer would escape them again on every row
+    extension = ".csv"
+
+    def __init__(self, path, fields, dictionary_fields=()):
+        self.fields = fields
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.file.write(",".join(map(quote, fields)) + "\r\n")
+
+    def write(self, columns):
+        quoted = {}
+        lines = []
+        for row in zip(*(columns[field] for field in self.fields)):
+            cells = []
+            for value in row:
+                text = quoted.get(value)
+                if text is None:
+                    text = quoted[value] = quote(value)
+                cells.append(text)
+            # csv.writer quotes a lone empty field, a blank line would read
+            # back as no row at all
+            lines.append(",".join(cells) or '""')
+        lines.append("")
+        self.file.write("\r\n".join(lines))
+
+    def close(self):
+        self.file.close()
+
+
+_NEEDS_QUOTES = re.compile(r'[",\r\n]')
+
+
+def quote(value):
+    if _NEEDS_QUOTES.search(value):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+class ParquetBatchWriter:
+    extension = ".parquet"
+
+    def __init__(self, path, fields, dictionary_fields=()):
+        self.fields = fields
+        self.schema = pyarrow.schema([(field, pyarrow.string()) for field in fields])
+        self.writer = pyarrow.parquet.ParquetWriter(
+            path,
+            self.schema,
+            compression="zstd",
+            use_dictionary=[field for field in fields if field in dictionary_fields],
+        )
+
+    def write(self, columns):
+        arrays = [pyarrow.array(columns[field], type=pyarrow.string()) for field in self.fields]
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def writer_class(format):
+    # "auto" picks Parquet when pyarrow is there, CSV otherwise
+    if format == "parquet" or (format == "auto" and pyarrow is not None):
+        if pyarrow is None:
+            raise RuntimeError("Parquet export needs pyarrow")
+        return ParquetBatchWriter
+    return CsvBatchWriter
+
+
+class BatchExporter:
+    def __init__(self, path, fields, format="auto", batch_size=10000, dictionary_fields=()):
+        cls = writer_class(format)
+        self.path = os.path.splitext(path)[0] + cls.extension
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.fields = list(fields)
+        self.batch_size = batch_size
+        self.writer = cls(self.path, self.fields, set(dictionary_fields))
+        self._columns = {field: [] for field in self.fields}
+        self._json_cache = {}
+        self._rows = 0
+        self.count = 0
+
+    def add(self, row):
+        # `row` is any mapping; fields it lacks are written empty
+        for field, column in self._columns.items():
+            column.append(cell(row.get(field), self._json_cache))
+        self._rows += 1
+        self.count += 1
+        if self._rows >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        self.writer.write(self._columns)
+        self._columns = {field: [] for field in self.fields}
+        self._json_cache = {}
+        self._rows = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+# Benchmark
+
+FIELDS = [
+    "make", "modelDisplayName", "model", "year", "bodyType", "msrp", "image", "bodyStyle", "cabType",
+    "bedLength", "driveType", "trim", "exteriorColors", "interiorColors", "packages",
+]
+DICTIONARY_FIELDS = {"make", "modelDisplayName", "model", "year", "bodyType", "bodyStyle", "cabType",
+                     "bedLength", "driveType", "trim", "exteriorColors", "interiorColors", "packages"}
+
+
+def _synthetic_rows(count):
+    # Trims of a model share their colors and packages, like the real output
+    colors = [[{"name": f"Color {c}", "price": "$495", "image_url": f"https://example.com/{m}/{c}.png"} for c in range(8)]
+              for m in range(40)]
+    packages = [[{"title": f"Package {p}", "options": ["Heated seats, front", "Bose audio"], "price": "$1,295"}
+                 for p in range(5)] for m in range(40)]
+    for n in range(count):
+        m = n % 40
+        yield {
+            "make": "chevrolet", "modelDisplayName": f"Model {m}", "model": f"model-{m}", "year": 2024 + n % 3,
+            "bodyType": "TRUCKS", "msrp": 30000 + n % 997, "image": f"https://example.com/{n}.png",
+            "bodyStyle": "crew-cab", "cabType": "Crew Cab", "bedLength": "Short Bed", "driveType": "4WD",
+            "trim": f"LT {n % 7}", "exteriorColors": colors[m], "interiorColors": colors[(m + 1) % 40],
+            "packages": packages[m],
+        }
+
+
+def _fstring_lines(path, rows):
+    # What ChevyPipeline used to do
+    with open(path, "w") as f:
+        f.write(",".join(FIELDS) + "\n")
+        for item in rows:
+            item["exteriorColors"] = json.dumps(item["exteriorColors"])
+            item["interiorColors"] = json.dumps(item["interiorColors"])
+            item["packages"] = json.dumps(item["packages"])
+            f.write(",".join(str(item.get(field, "")) for field in FIELDS) + "\n")
+
+
+def _run(label, path, write):
+    started = time.perf_counter()
+    write()
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(path)
+    print(f"{label:22} {elapsed:7.1f} s  {size / 1024 / 1024:8.1f} MiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the export writers")
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args(argv)
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{args.rows} rows")
+        path = os.path.join(directory, "fstring.csv")
+        _run("f-string lines", path, lambda: _fstring_lines(path, _synthetic_rows(args.rows)))
+        formats = ["csv"] + (["parquet"] if pyarrow is not None else [])
+        for format in formats:
+            exporter = BatchExporter(os.path.join(directory, "export"), FIELDS, format, dictionary_fields=DICTIONARY_FIELDS)
+
+            def write():
+                for row in _synthetic_rows(args.rows):
+                    exporter.add(row)
+                exporter.close()
+
+            _run(f"BatchExporter {format}", exporter.path, write)
+        if pyarrow is None:
+            print("pyarrow isn't installed, Parquet skipped")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+# GraphQL helpers for the orchestrator.configurator.toyota.com API
+#
+# AliasedQuery requests the same root field several times in one document,
+# each under its own alias ("a0", "a1", ...) with its own variables, so a
+# batch of lookups costs a single POST. Errors are reported per alias through
+# their "path", so one bad lookup doesn't sink the rest of the batch.
+#
+# Every document goes through the registry, which minifies it once,
+# precomputes its SHA-256 and the encoded body prefixes, so requests can be
+# sent Automatic Persisted Query style: hash only first, and the full text
+# only when the server answers PersistedQueryNotFound (PersistedQueryMiddleware).
+import hashlib
+import json
+import re
+
+_WHITESPACE = re.compile(r"\s+")
+_PUNCTUATION = re.compile(r" ?([{}():,=!\[\]]) ?")
+
+
+def minify(document):
+    # The documents here hold no string literals, so all whitespace is
+    # insignificant except for a single space between names
+    return _PUNCTUATION.sub(r"\1", _WHITESPACE.sub(" ", document).strip())
+
+
+class PersistedQuery:
+    def __init__(self, document):
+        self.text = minify(document)
+        self.operation = re.match(r"(?:query|mutation)\s*(\w+)", self.text).group(1)
+        self.sha256 = hashlib.sha256(self.text.encode("utf-8")).hexdigest()
+        extensions = {"persistedQuery": {"version": 1, "sha256Hash": self.sha256}}
+        # Bodies are <prefix><variables JSON>}, only the variables are
+        # serialised per request
+        self.persisted_prefix = (
+            '{"operationName":%s,"extensions":%s,"variables":'
+            % (json.dumps(self.operation), json.dumps(extensions, separators=(",", ":")))
+        ).encode("utf-8")
+        self.full_prefix = (
+            '{"operationName":%s,"query":%s,"extensions":%s,"variables":'
+            % (json.dumps(self.operation), json.dumps(self.text), json.dumps(extensions, separators=(",", ":")))
+        ).encode("utf-8")
+
+    def body(self, variables, persisted=True):
+        prefix = self.persisted_prefix if persisted else self.full_prefix
+        return prefix + json.dumps(variables, separators=(",", ":")).encode("utf-8") + b"}"
+
+    def full_body(self, persisted_body):
+        # Same request with the query text, for a PersistedQueryNotFound retry
+        return self.full_prefix + persisted_body[len(self.persisted_prefix):]
+
+
+class QueryRegistry:
+    def __init__(self):
+        self._by_hash = {}
+
+    def register(self, document):
+        query = PersistedQuery(document)
+        return self._by_hash.setdefault(query.sha256, query)
+
+    def get(self, sha256):
+        return self._by_hash.get(sha256)
+
+
+REGISTRY = QueryRegistry()
+
+
+class AliasedQuery:
+    def __init__(self, name, field, shared, per_alias, selection):
+        # shared / per_alias map argument names to GraphQL types; shared
+        # arguments are declared once, per-alias ones once per alias
+        self.name = name
+        self.field = field
+        self.shared = shared
+        self.per_alias = per_alias
+        self.selection = selection
+        self._queries = {}
+
+    @staticmethod
+    def alias(index):
+        return f"a{index}"
+
+    def query(self, count):
+        # Documents only depend on the batch size, so they are built and
+        # registered once per size
+        if count not in self._queries:
+            declarations = [f"${name}: {kind}" for name, kind in self.shared.items()]
+            fields = []
+            for index in range(count):
+                declarations.extend(f"${name}{index}: {kind}" for name, kind in self.per_alias.items())
+                arguments = [f"{name}: ${name}" for name in self.shared]
+                arguments.extend(f"{name}: ${name}{index}" for name in self.per_alias)
+                fields.append(f"{self.alias(index)}: {self.field}({', '.join(arguments)}) {self.selection}")
+            self._queries[count] = REGISTRY.register(f"query {self.name}({', '.join(declarations)}) {{ {' '.join(fields)} }}")
+        return self._queries[count]
+
+    def variables(self, shared, entries):
+        variables = dict(shared)
+        for index, entry in enumerate(entries):
+            for name in self.per_alias:
+                variables[f"{name}{index}"] = entry[name]
+        return variables
+
+    def body(self, shared, entries, persisted=True):
+        return self.query(len(entries)).body(self.variables(shared, entries), persisted)
+
+    def split(self, payload, count):
+        # Returns one (data, errors) pair per alias. Errors without a path
+        # belong to the whole document and are given to every alias.
+        data = payload.get("data") or {}
+        errors = {self.alias(index): [] for index in range(count)}
+        for error in payload.get("errors") or []:
+            path = error.get("path") or []
+            if path and path[0] in errors:
+                errors[path[0]].append(error)
+            else:
+                for alias_errors in errors.values():
+                    alias_errors.append(error)
+        return [(data.get(self.alias(index)), errors[self.alias(index)]) for index in range(count)]
+
+
+def chunks(entries, size):
+    size = max(1, size)
+    for start in range(0, len(entries), size):
+        yield entries[start:start + size]
@@ -2,6 +2,16 @@
 #
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
+#
+# Records are frozen, slotted dataclasses: no per-instance __dict__, and
+# since they can't change, a callback derives the next record with
+# replace() instead of deep-copying the previous one. replace() only copies
+# the references, so nested data (colors, packages) is shared by every
+# record derived from the same parent. ItemAdapter, and with it the feed
+# exporters and pipelines, handles dataclasses as items.
+import dataclasses
+from dataclasses import dataclass
+from typing import Any
 
 import scrapy
 
@@ -10,3 +20,70 @@ class ScraperItem(scrapy.Item):
     # define the fields for your item here like:
     # name = scrapy.Field()
     pass
+
+
+class Record:
+    __slots__ = ()
+
+    def replace(self, **changes):
+        return dataclasses.replace(self, **changes)
+
+    def asdict(self):
+        # Shallow, unlike dataclasses.asdict, which deep-copies nested data
+        return {field.name: getattr(self, field.name) for field in dataclasses.fields(self)}
+
+
+@dataclass(frozen=True, slots=True)
+class VehicleRecord(Record):
+    # A manufacturer model, then one of its trims as more fields are known
+    make: Any = None
+    modelDisplayName: Any = None
+    model: Any = None
+    year: Any = None
+    bodyType: Any = None
+    msrp: Any = None
+    image: Any = None
+    bodyStyle: Any = None
+    cabType: Any = None
+    bedLength: Any = None
+    driveType: Any = None
+    trim: Any = None
+    engineType: Any = None
+    transmissionType: Any = None
+    fuelType: Any = None
+    url: Any = None
+    exteriorColors: Any = None
+    interiorColors: Any = None
+    packages: Any = None
+
+
+@dataclass(frozen=True, slots=True)
+class DealerListing(Record):
+    # One vehicle of a dealer's inventory (DDC sites)
+    Make: Any = None
+    Model: Any = None
+    Trim: Any = None
+    Year: Any = None
+    VIN: Any = None
+    MSRP: Any = None
+    FuelType: Any = None
+    BodyStyle: Any = None
+    Engine: Any = None
+    Transmission: Any = None
+    ExteriorColor: Any = None
+    ExteriorColorGeneric: Any = None
+    InteriorColor: Any = None
+    InteriorColorGeneric: Any = None
+    DriveTrain: Any = None
+    NumberOfDoors: Any = None
+    CityMPG: Any = None
+    HighwayMPG: Any = None
+    Features: Any = None
+    Image: Any = None
+    Link: Any = None
+    Source: Any = None
+    CollectedFrom: Any = None
+    Style: Any = None
+
+
+RECORD_TYPES = {cls.__name__: cls for cls in (VehicleRecord, DealerListing)}
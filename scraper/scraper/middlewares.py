@@ -3,35 +3,19 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 import json
+import re
 
 from scrapy import signals
+from scrapy.core.downloader import Slot
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import task
+
+from scraper.graphql import REGISTRY
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
-class ChevyPipeline:
-    def open_spider(self, spider):
-        self.file = open("enriched_output.csv", "w")
-        self.file.write("make,modelDisplayName,model,year,bodyType,msrp,image,bodyStyle,cabType,bedLength,driveType,trim,exteriorColors,interiorColors,packages\n")
-
-    def close_spider(self, spider):
-        self.file.close()
-
-    def process_item(self, item, spider):
-        # Convert complex fields to JSON strings for CSV compatibility
-        item["exteriorColors"] = json.dumps(item.get("exteriorColors", []))
-        item["interiorColors"] = json.dumps(item.get("interiorColors", []))
-        item["packages"] = json.dumps(item.get("packages", []))
-        # Write to enriched_output.csv
-        line = (
-            f"{item.get('make', '')},{item.get('modelDisplayName', '')},{item.get('model', '')},"
-            f"{item.get('year', '')},{item.get('bodyType', '')},{item.get('msrp', '')},"
-            f"{item.get('image', '')},{item.get('bodyStyle', '')},{item.get('cabType', '')},"
-            f"{item.get('bedLength', '')},{item.get('driveType', '')},{item.get('trim', '')},"
-            f"{item.get('exteriorColors', '')},{item.get('interiorColors', '')},{item.get('packages', '')}\n"
-        )
-        self.file.write(line)
-        return item
-
 class DealerCrawlersSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
     # scrapy acts as if the spider middleware does not modify the
@@ -135,3 +119,212 @@ class ProxyMiddleware(object):
 
     def get_proxy(self):
         return self.proxy
+
+
+class PagePoolMiddleware:
+    # Hands pooled Playwright pages to requests that carry a "page_pool" meta
+    # key (see scraper.browser.PagePool) and periodically reaps the pages
+    # that were never handed back. Spiders expose their pool as `page_pool`.
+    def __init__(self, interval):
+        self.interval = interval
+        self.reaper = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler.settings.getfloat("PLAYWRIGHT_POOL_REAP_INTERVAL", 60))
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def process_request(self, request, spider):
+        pool = getattr(spider, "page_pool", None)
+        if pool is not None and request.meta.get("playwright") and "page_pool" in request.meta:
+            pool.checkout(request)
+        return None
+
+    def spider_opened(self, spider):
+        pool = getattr(spider, "page_pool", None)
+        if pool is not None:
+            self.reaper = task.LoopingCall(lambda: deferred_from_coro(pool.reap()))
+            self.reaper.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.reaper is not None and self.reaper.running:
+            self.reaper.stop()
+        pool = getattr(spider, "page_pool", None)
+        if pool is not None:
+            return deferred_from_coro(pool.close())
+
+
+class PersistedQueryMiddleware:
+    # GraphQL requests built from scraper.graphql.REGISTRY are sent with the
+    # query hash only ("graphql_persisted" meta). When the server doesn't know
+    # the hash yet, the request is sent again with the full query text, which
+    # also registers it; hosts that don't support persisted queries at all
+    # get the full text from then on. Any other error answer without data is
+    # a miss too: a server without APQ support may not use the standard
+    # markers ("Must provide query string"), and if it has never answered a
+    # hash-only request, it is taken as not supporting them.
+    def __init__(self, stats):
+        self.stats = stats
+        self.unsupported = set()
+        self.supported = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def process_request(self, request, spider):
+        if request.meta.get("graphql_persisted") and urlparse_cached(request).netloc in self.unsupported:
+            return self._with_query(request)
+        return None
+
+    def process_response(self, request, response, spider):
+        if not request.meta.get("graphql_persisted"):
+            return response
+        if b"PersistedQueryNotSupported" in response.body or b"PERSISTED_QUERY_NOT_SUPPORTED" in response.body:
+            self.unsupported.add(urlparse_cached(request).netloc)
+            self.stats.inc_value("graphql/persisted/unsupported")
+            return self._with_query(request)
+        if b"PersistedQueryNotFound" in response.body or b"PERSISTED_QUERY_NOT_FOUND" in response.body:
+            self.stats.inc_value("graphql/persisted/miss")
+            return self._with_query(request)
+        host = urlparse_cached(request).netloc
+        if _errors_without_data(response.body):
+            self.stats.inc_value("graphql/persisted/miss")
+            if host not in self.supported:
+                self.unsupported.add(host)
+                self.stats.inc_value("graphql/persisted/unsupported")
+            return self._with_query(request)
+        self.supported.add(host)
+        self.stats.inc_value("graphql/persisted/hit")
+        return response
+
+    def _with_query(self, request):
+        query = REGISTRY.get(request.meta.get("graphql_query"))
+        meta = dict(request.meta, graphql_persisted=False)
+        return request.replace(body=query.full_body(request.body), meta=meta, dont_filter=True)
+
+
+def _errors_without_data(body):
+    # A GraphQL answer with "errors" and no "data", i.e. nothing was executed
+    if b'"errors"' not in body:
+        return False
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return False
+    return isinstance(payload, dict) and bool(payload.get("errors")) and not payload.get("data")
+
+
+class AdaptiveRateMiddleware:
+    # AIMD rate control per endpoint. Every request is put in a download slot
+    # named after its endpoint (the first ADAPTIVE_RATE_ENDPOINTS pattern that
+    # matches host + path, else the host), and each slot's concurrency and
+    # delay are adjusted from the responses it gets back:
+    #   - healthy and fast: concurrency +1, delay shrinks a little
+    #   - 429/403/503 or errors: concurrency halved, delay doubled and never
+    #     below the Retry-After the server asked for
+    #   - slow (above ADAPTIVE_RATE_TARGET_LATENCY): concurrency -1; not for
+    #     Playwright requests, whose download time is mostly rendering
+    # The learned values are kept here and applied to the endpoint's slot on
+    # every request: Scrapy drops idle slots and would otherwise start them
+    # over from its defaults. Has to sit after RetryMiddleware (550) so it
+    # sees the throttled responses before they are retried.
+    THROTTLED = (429, 403, 503)
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ADAPTIVE_RATE_ENABLED"):
+            raise NotConfigured
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.endpoints = [re.compile(pattern) for pattern in settings.getlist("ADAPTIVE_RATE_ENDPOINTS")]
+        self.start_concurrency = settings.getint("ADAPTIVE_RATE_START_CONCURRENCY", 1)
+        self.max_concurrency = settings.getint("ADAPTIVE_RATE_MAX_CONCURRENCY", 8)
+        self.start_delay = settings.getfloat("ADAPTIVE_RATE_START_DELAY", 1.0)
+        self.min_delay = settings.getfloat("ADAPTIVE_RATE_MIN_DELAY", 0.0)
+        self.max_delay = settings.getfloat("ADAPTIVE_RATE_MAX_DELAY", 60.0)
+        self.target_latency = settings.getfloat("ADAPTIVE_RATE_TARGET_LATENCY", 5.0)
+        self.rates = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def endpoint(self, request):
+        parsed = urlparse_cached(request)
+        target = parsed.netloc + parsed.path
+        for pattern in self.endpoints:
+            match = pattern.search(target)
+            if match:
+                return match.group(0)
+        return parsed.netloc
+
+    def process_request(self, request, spider):
+        if "download_slot" not in request.meta:
+            request.meta["download_slot"] = self.endpoint(request)
+        key = request.meta["download_slot"]
+        rate = self.rates.get(key)
+        if rate is None:
+            rate = self.rates[key] = EndpointRate(self.start_concurrency, self.start_delay)
+            self._record(key, rate)
+        self._apply(key, rate)
+        return None
+
+    def process_response(self, request, response, spider):
+        rate = self.rates.get(request.meta.get("download_slot"))
+        if rate is None:
+            return response
+        key = request.meta["download_slot"]
+        if response.status in self.THROTTLED:
+            self.stats.inc_value(f"rate/{key}/throttled")
+            self._back_off(rate, self._retry_after(response))
+        elif not request.meta.get("playwright") and request.meta.get("download_latency", 0) > self.target_latency:
+            rate.concurrency = max(1, rate.concurrency - 1)
+        elif response.status < 400:
+            rate.concurrency = min(self.max_concurrency, rate.concurrency + 1)
+            rate.delay = max(self.min_delay, rate.delay * 0.9)
+        self._apply(key, rate)
+        self._record(key, rate)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        rate = self.rates.get(request.meta.get("download_slot"))
+        if rate is not None:
+            key = request.meta["download_slot"]
+            self.stats.inc_value(f"rate/{key}/errors")
+            self._back_off(rate, 0)
+            self._apply(key, rate)
+            self._record(key, rate)
+        return None
+
+    def _apply(self, key, rate):
+        # Onto the slot Scrapy has for the endpoint, or a new one
+        slots = self.crawler.engine.downloader.slots
+        slot = slots.get(key)
+        if slot is None:
+            slots[key] = Slot(rate.concurrency, rate.delay, False)
+        else:
+            slot.concurrency = rate.concurrency
+            slot.delay = rate.delay
+
+    def _back_off(self, rate, retry_after):
+        rate.concurrency = max(1, rate.concurrency // 2)
+        rate.delay = min(self.max_delay, max(rate.delay * 2, self.start_delay, retry_after))
+
+    def _retry_after(self, response):
+        value = response.headers.get("Retry-After", b"").decode("latin-1").strip()
+        return float(value) if value.isdigit() else 0
+
+    def _record(self, key, rate):
+        self.stats.set_value(f"rate/{key}/concurrency", rate.concurrency)
+        self.stats.set_value(f"rate/{key}/delay_ms", int(rate.delay * 1000))
+
+
+class EndpointRate:
+    __slots__ = ("concurrency", "delay")
+
+    def __init__(self, concurrency, delay):
+        self.concurrency = concurrency
+        self.delay = delay
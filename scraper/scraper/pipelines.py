@@ -4,10 +4,146 @@
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
 
+import csv
+import os
+
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy.exceptions import DropItem
+
+from scraper.dedup import DedupIndex
+from scraper.export import BatchExporter
 
 
 class ScraperPipeline:
     def process_item(self, item, spider):
         return item
+
+
+class NormalizedOutputPipeline:
+    # Writes the grade and trim records of a normalized crawl to
+    # <base>_grades.csv and <base>_trims.csv, where <base> is the spider's
+    # filepath without extension. Grades are kept in memory (a few hundred
+    # rows) so the flat one-row-per-trim CSV can be derived at the end for
+    # the consumers that still read it.
+    def open_spider(self, spider):
+        self.base = os.path.splitext(spider.filepath)[0]
+        self.grades = {}
+        self.grade_file = open(f"{self.base}_grades.csv", "w", encoding="utf-8", newline="")
+        self.trim_file = open(f"{self.base}_trims.csv", "w", encoding="utf-8", newline="")
+        self.grade_writer = csv.DictWriter(self.grade_file, fieldnames=spider.grade_fields, extrasaction="ignore")
+        self.trim_writer = csv.DictWriter(self.trim_file, fieldnames=spider.trim_fields, extrasaction="ignore")
+        self.grade_writer.writeheader()
+        self.trim_writer.writeheader()
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        record_type = adapter.get("record_type")
+        if record_type == "grade":
+            self.grades[adapter["grade_key"]] = adapter.asdict()
+            self.grade_writer.writerow(adapter.asdict())
+        elif record_type == "trim":
+            self.trim_writer.writerow(adapter.asdict())
+        return item
+
+    def close_spider(self, spider):
+        self.grade_file.close()
+        self.trim_file.close()
+        self.write_flat(spider.filepath, spider.flat_fields)
+
+    def write_flat(self, path, fields):
+        with open(f"{self.base}_trims.csv", encoding="utf-8", newline="") as trims, \
+                open(path, "w", encoding="utf-8", newline="") as out:
+            writer = csv.DictWriter(out, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            for trim in csv.DictReader(trims):
+                grade = self.grades.get(trim["grade_key"], {})
+                writer.writerow({**grade, **trim})
+
+
+class ColumnarExportPipeline:
+    # Buffered export with a fixed schema per spider (see scraper.export):
+    # EXPORT_FIELDS, or FEED_EXPORT_FIELDS, in EXPORT_FORMAT ("auto" is
+    # Parquet when pyarrow is installed, CSV otherwise) to EXPORT_FILE, whose
+    # extension follows the format
+    def __init__(self, settings, stats):
+        self.settings = settings
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler.stats)
+
+    def open_spider(self, spider):
+        settings = self.settings
+        self.exporter = BatchExporter(
+            settings.get("EXPORT_FILE") or f"output/{spider.name}",
+            settings.getlist("EXPORT_FIELDS") or settings.getlist("FEED_EXPORT_FIELDS"),
+            format=settings.get("EXPORT_FORMAT", "auto"),
+            batch_size=settings.getint("EXPORT_BATCH_SIZE", 10000),
+            dictionary_fields=settings.getlist("EXPORT_DICTIONARY_FIELDS"),
+        )
+        spider.logger.info(f"Exporting items to {self.exporter.path}")
+
+    def process_item(self, item, spider):
+        self.exporter.add(ItemAdapter(item))
+        return item
+
+    def close_spider(self, spider):
+        self.exporter.close()
+        self.stats.set_value("export/rows", self.exporter.count)
+
+
+class DedupPipeline:
+    # Drops items whose key was already emitted in this run, or in an
+    # earlier one with DEDUP_PERSIST (see scraper.dedup). The key is DEDUP_KEY_FIELDS, by default the
+    # VIN for dealer listings and make/model/year/trim otherwise. Duplicate
+    # rates are counted per source (the dealer, or the spider).
+    DEFAULT_KEY_FIELDS = ["make", "model", "year", "trim"]
+
+    def __init__(self, settings, stats):
+        self.settings = settings
+        self.stats = stats
+        self.key_fields = settings.getlist("DEDUP_KEY_FIELDS")
+        self.sources = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler.stats)
+
+    def open_spider(self, spider):
+        self.index = DedupIndex.from_settings(self.settings, spider.name)
+
+    def key(self, adapter):
+        if self.key_fields:
+            fields = self.key_fields
+        elif "VIN" in adapter.field_names():
+            fields = ["VIN"]
+        else:
+            fields = self.DEFAULT_KEY_FIELDS
+        values = [adapter.get(field) for field in fields]
+        if all(value in (None, "") for value in values):
+            return None
+        return "|".join("" if value is None else str(value).strip().upper() for value in values)
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        source = adapter.get("Source") or spider.name
+        self.sources.add(source)
+        key = self.key(adapter)
+        if key is None:
+            self.stats.inc_value(f"dedup/{source}/no_key")
+            return item
+        self.stats.inc_value(f"dedup/{source}/seen")
+        if self.index.check_and_add(key, source):
+            self.stats.inc_value(f"dedup/{source}/duplicates")
+            raise DropItem(f"Duplicate {key}")
+        return item
+
+    def close_spider(self, spider):
+        self.index.close()
+        for source in self.sources:
+            seen = self.stats.get_value(f"dedup/{source}/seen", 0)
+            if seen:
+                duplicates = self.stats.get_value(f"dedup/{source}/duplicates", 0)
+                self.stats.set_value(f"dedup/{source}/duplicate_rate", round(duplicates / seen, 4))
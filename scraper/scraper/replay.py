@@ -0,0 +1,96 @@
+# Local stand-in for a dealer site, serving recorded responses
+#
+# Every response is a file in the recordings directory, named after the
+# quoted path and query of its request. With --record the server forwards
+# requests it has no recording for to the real site and saves the answer,
+# so a session can be captured once and replayed offline afterwards:
+#
+#     python -m scraper.replay recordings/napleton --record https://www.napletonacura.com
+#     python -m scraper.replay recordings/napleton
+#     scrapy crawl ddcContent -a urls=- <<< "http://127.0.0.1:8765/new-inventory/index.htm"
+#
+# Requests without a recording get a 404, which is also how a dealer
+# without the JSON inventory API looks to the spider.
+import argparse
+import os
+import sys
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
+
+
+def recording_name(path):
+    return quote(path, safe="")
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    directory = "."
+    origin = None
+
+    def do_GET(self):
+        path = os.path.join(self.directory, recording_name(self.path))
+        if not os.path.exists(path) and self.origin:
+            self.record(path)
+        if not os.path.exists(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type(body))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def record(self, path):
+        request = urllib.request.Request(self.origin + self.path, headers={"User-Agent": self.headers.get("User-Agent", "")})
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                body = response.read()
+        except urllib.error.URLError as e:
+            self.log_message("Not recorded %s: %s", self.path, e)
+            return
+        with open(path, "wb") as f:
+            f.write(body)
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f"replay: {format % args}\n")
+
+
+def content_type(body):
+    if body.lstrip()[:1] in (b"{", b"["):
+        return "application/json"
+    return "text/html; charset=utf-8"
+
+
+def make_server(directory, port=8765, origin=None):
+    # Port 0 picks a free one (tests), see server.server_address
+    os.makedirs(directory, exist_ok=True)
+    handler = type("Handler", (ReplayHandler,), {"directory": directory, "origin": origin and origin.rstrip("/")})
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+
+def serve(directory, port=8765, origin=None):
+    server = make_server(directory, port, origin)
+    print(f"Replaying {directory} on http://127.0.0.1:{port}/", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve recorded dealer site responses")
+    parser.add_argument("directory")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--record", metavar="ORIGIN", help="fetch and save missing responses from this site")
+    args = parser.parse_args(argv)
+    serve(args.directory, args.port, args.record)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
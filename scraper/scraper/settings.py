@@ -7,6 +7,8 @@
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import os
+
 BOT_NAME = "scraper"
 
 SPIDER_MODULES = ["scraper.spiders"]
@@ -23,9 +25,55 @@ DOWNLOAD_HANDLERS = {
 
 # Playwright settings
 PLAYWRIGHT_BROWSER_TYPE = "chromium"
-PLAYWRIGHT_LAUNCH_OPTIONS = {
-    "headless": False,  # Non-headless for debugging
-    "slow_mo": 500,     # Slow down actions
+# Browser launch profiles. The active one is picked with the
+# PLAYWRIGHT_LAUNCH_PROFILE setting (e.g. -s PLAYWRIGHT_LAUNCH_PROFILE=dev) or
+# the SCRAPER_PLAYWRIGHT_PROFILE environment variable, and is turned into
+# PLAYWRIGHT_LAUNCH_OPTIONS by
+# scraper.browser.LaunchProfileAddon
+PLAYWRIGHT_LAUNCH_PROFILE = os.environ.get("SCRAPER_PLAYWRIGHT_PROFILE", "production")
+PLAYWRIGHT_LAUNCH_PROFILES = {
+    "production": {
+        "launch_options": {
+            "headless": True,
+            "args": [
+                "--disable-blink-features=AutomationControlled",  # Bypass bot detection
+                "--no-sandbox",
+                "--disable-dev-shm-usage",
+                "--disable-gpu",
+                "--disable-features=IsolateOrigins,site-per-process",  # Fewer renderer processes
+            ],
+        },
+        "screenshots": False,
+    },
+    "dev": {
+        "launch_options": {
+            "headless": False,  # Non-headless for debugging
+            "slow_mo": 500,     # Slow down actions
+            "args": [
+                "--disable-blink-features=AutomationControlled",
+                "--no-sandbox",
+                "--disable-dev-shm-usage",
+                "--disable-gpu",
+                "--disable-web-security",  # Relax security for testing
+                "--disable-features=IsolateOrigins,site-per-process",
+            ],
+        },
+        "screenshots": True,
+    },
+    "debug": {
+        "launch_options": {
+            "headless": False,
+            "slow_mo": 500,
+            "devtools": True,
+            "args": [
+                "--disable-blink-features=AutomationControlled",
+                "--no-sandbox",
+                "--disable-dev-shm-usage",
+                "--disable-web-security",
+            ],
+        },
+        "screenshots": True,
+    },
 }
 
 # Playwright context settings
@@ -33,6 +81,72 @@ PLAYWRIGHT_DEFAULT_NAVIGATION_TIMEOUT = 60000  # 60 seconds for navigation
 PLAYWRIGHT_MAX_PAGES_PER_CONTEXT = 1          # One page per context for stability
 PLAYWRIGHT_PROCESS_REQUEST_HEADERS = None      # Preserve custom headers
 
+# Route-interception profile for pages using scraper.browser.ResourceBlocker
+# ("full", "render-minimal" or "data-only", see RESOURCE_PROFILES). Requests
+# can pick another one with the "resource_profile" meta key.
+PLAYWRIGHT_RESOURCE_PROFILE = "full"
+# Extra or overridden profiles, e.g.
+# {"no-images": {"resource_types": ["image"], "patterns": []}}
+PLAYWRIGHT_RESOURCE_PROFILES = {}
+
+# Page readiness (scraper.browser.PageReadiness): a page is ready once its
+# target data is present and there has been no network activity / DOM
+# mutation for these windows, or once the ceiling is reached
+PLAYWRIGHT_READY_NETWORK_QUIET_MS = 500
+PLAYWRIGHT_READY_DOM_SETTLE_MS = 300
+PLAYWRIGHT_READY_TIMEOUT_MS = 30000
+
+# Page pool (scraper.browser.PagePool) for spiders that reuse Playwright pages:
+# contexts per pool, idle pages kept warm per pool, navigations before a page
+# or context is recycled, browser RSS ceiling in MB (0 disables it) and how
+# long a page may stay checked out before it is treated as leaked and closed
+PLAYWRIGHT_POOL_CONTEXTS = 2
+PLAYWRIGHT_POOL_IDLE_PAGES = 4
+PLAYWRIGHT_POOL_MAX_NAVIGATIONS = 50
+PLAYWRIGHT_POOL_MAX_CONTEXT_NAVIGATIONS = 500
+PLAYWRIGHT_POOL_MAX_RSS_MB = 0
+PLAYWRIGHT_POOL_PAGE_TTL = 300
+PLAYWRIGHT_POOL_REAP_INTERVAL = 60
+
+# Browser event instrumentation (scraper.browser.PageInstrumentation): the
+# page events that get a handler at all, and the share of those events that
+# is also logged individually (the rest only feed the stats)
+PLAYWRIGHT_INSTRUMENT_EVENTS = ["pageerror", "requestfailed", "response"]
+PLAYWRIGHT_INSTRUMENT_LOG_SAMPLE_RATE = 0.0
+
+# Debug artifacts (scraper.artifacts.ArtifactStore): screenshot + HTML of pages
+# where extraction failed or fell back, plus a sampled share of the others.
+# The directory keeps at most DEBUG_ARTIFACTS_MAX captures. The sample rate
+# defaults to 0, or 1 under launch profiles with "screenshots" enabled.
+DEBUG_ARTIFACTS_DIR = "debug_artifacts"
+DEBUG_ARTIFACTS_MAX = 200
+#DEBUG_ARTIFACTS_SAMPLE_RATE = 0.05
+DEBUG_ARTIFACTS_FULL_PAGE = False
+
+# Dead letters (scraper.deadletter.DeadLetterQueue): requests that failed for
+# good, one JSON line each in DEAD_LETTER_DIR/<spider>_<time>_<pid>.jsonl,
+# written DEAD_LETTER_BUFFER at a time. Rerun only those with
+# -a replay=<file>.
+DEAD_LETTER_DIR = "output/dead_letters"
+DEAD_LETTER_BUFFER = 50
+
+# Columnar export (scraper.pipelines.ColumnarExportPipeline), for spiders that
+# enable it: "auto" writes Parquet when pyarrow is installed and CSV
+# otherwise, EXPORT_BATCH_SIZE rows at a time
+EXPORT_FORMAT = "auto"
+EXPORT_BATCH_SIZE = 10000
+
+# Deduplication (scraper.pipelines.DedupPipeline), for spiders that enable
+# it: every key is emitted once per run, behind a Bloom filter sized for
+# DEDUP_CAPACITY keys. DEDUP_PERSIST keeps the keys in
+# DEDUP_DIR/<spider>.sqlite across runs, for incremental exports; it needs a
+# positive DEDUP_TTL_DAYS, after which a key is let through again.
+DEDUP_DIR = "output/dedup"
+DEDUP_PERSIST = False
+DEDUP_CAPACITY = 1000000
+DEDUP_ERROR_RATE = 0.001
+DEDUP_TTL_DAYS = 0
+
 # Ensure cookies are enabled
 COOKIES_ENABLED = True
 
@@ -87,13 +201,40 @@ RANDOMIZE_DOWNLOAD_DELAY = False
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
     "scraper.middlewares.ProxyMiddleware": 543,
+    "scraper.middlewares.PagePoolMiddleware": 544,
+    "scraper.middlewares.PersistedQueryMiddleware": 545,
+    "scraper.middlewares.AdaptiveRateMiddleware": 560,
 }
 
+# Adaptive per-endpoint rate control (scraper.middlewares.AdaptiveRateMiddleware).
+# Each endpoint starts at the start concurrency/delay and moves between the
+# bounds depending on how healthy its responses are. Endpoints are matched
+# against host + path; anything else is limited per host. Spiders opt in with
+# ADAPTIVE_RATE_ENABLED and their own CONCURRENT_REQUESTS ceiling.
+ADAPTIVE_RATE_ENABLED = False
+ADAPTIVE_RATE_ENDPOINTS = [
+    r"orchestrator\.configurator\.toyota\.com/graphql",
+    r"www\.chevrolet\.com/chevrolet/shopping/api/aec-cp-configurator-gateway/p/v1/\w+",
+    r"www\.chevrolet\.com/shopping/configurator",
+]
+ADAPTIVE_RATE_START_CONCURRENCY = 1
+ADAPTIVE_RATE_MAX_CONCURRENCY = 8
+ADAPTIVE_RATE_START_DELAY = 1.0
+ADAPTIVE_RATE_MIN_DELAY = 0.0
+ADAPTIVE_RATE_MAX_DELAY = 60.0
+ADAPTIVE_RATE_TARGET_LATENCY = 5.0
+
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    "scraper.browser.LaunchProfileStats": 500,
+}
+
+# Add-ons
+# See https://docs.scrapy.org/en/latest/topics/addons.html
+ADDONS = {
+    "scraper.browser.LaunchProfileAddon": 0,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
@@ -0,0 +1,110 @@
+# Runs one crawl as several Scrapy processes, each with its own browser
+#
+# Every worker fetches the catalogue itself (a single POST) and keeps only
+# the models assigned to its shard, so no coordination is needed between
+# the processes. Each worker writes its own files, which are merged once all
+# of them are done.
+#
+# Usage (from the directory holding scrapy.cfg):
+#
+#     python -m scraper.shard chevrolet --workers 4 --output output/chevrolet
+#
+# Only spiders that set `supports_sharding = True` and take the shard and
+# shards arguments can be run this way; any other spider would crawl
+# everything in every worker.
+import argparse
+import os
+import subprocess
+import sys
+import zlib
+
+from scrapy.settings import Settings
+from scrapy.spiderloader import SpiderLoader
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def shard_of(*parts, shards):
+    # Stable across processes, unlike hash()
+    return zlib.crc32("/".join(str(part) for part in parts).encode("utf-8")) % shards
+
+
+def worker_command(spider, shard, shards, output_dir, extra_args=()):
+    return [
+        sys.executable, "-m", "scrapy", "crawl", spider,
+        "-a", f"shard={shard}",
+        "-a", f"shards={shards}",
+        "-s", f"EXPORT_FILE={os.path.join(output_dir, f'enriched_output-{shard}.csv')}",
+        "-s", f"LOG_FILE={os.path.join(output_dir, f'crawl-{shard}.log')}",
+        "-s", f"DEAD_LETTER_DIR={os.path.join(output_dir, f'dead_letters-{shard}')}",
+        *extra_args,
+    ]
+
+
+def merge_csv(paths, destination):
+    # Concatenates the shard files, keeping the header of the first one
+    header = None
+    with open(destination, "w", encoding="utf-8", newline="") as out:
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8", newline="") as f:
+                first = f.readline()
+                if header is None:
+                    header = first
+                    out.write(first)
+                for line in f:
+                    out.write(line)
+
+
+def merge_parquet(paths, destination):
+    import pyarrow.parquet
+
+    tables = [pyarrow.parquet.read_table(path) for path in paths if os.path.exists(path)]
+    if tables:
+        pyarrow.parquet.write_table(pyarrow.concat_tables(tables), destination, compression="zstd")
+
+
+def check_sharding(spider):
+    settings = Settings()
+    settings.setmodule("scraper.settings")
+    spidercls = SpiderLoader.from_settings(settings).load(spider)
+    if not getattr(spidercls, "supports_sharding", False):
+        raise ValueError(f"Spider {spider!r} doesn't support sharding")
+
+
+def run(spider, workers, output_dir, extra_args=()):
+    check_sharding(spider)
+    os.makedirs(output_dir, exist_ok=True)
+    processes = [
+        subprocess.Popen(worker_command(spider, shard, workers, output_dir, extra_args), cwd=PROJECT_DIR)
+        for shard in range(workers)
+    ]
+    failed = [shard for shard, process in enumerate(processes) if process.wait() != 0]
+    # The export is Parquet or CSV depending on whether pyarrow is installed
+    for extension, merge in ((".csv", merge_csv), (".parquet", merge_parquet)):
+        paths = [os.path.join(output_dir, f"enriched_output-{shard}{extension}") for shard in range(workers)]
+        if any(os.path.exists(path) for path in paths):
+            merge(paths, os.path.join(output_dir, f"enriched_output{extension}"))
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a spider as several sharded processes")
+    parser.add_argument("spider")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", default="output/shards")
+    args, extra_args = parser.parse_known_args(argv)
+    try:
+        check_sharding(args.spider)
+    except (KeyError, ValueError) as e:
+        parser.error(e.args[0])
+    failed = run(args.spider, args.workers, os.path.abspath(args.output), extra_args)
+    if failed:
+        print(f"Shards failed: {failed}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,32 +1,34 @@
-import copy
 import json
-import uuid
 import playwright
 import scrapy
+from scrapy.selector import Selector
 from scrapy_playwright.page import PageMethod
-from scrapy.item import Item, Field
-
-# Define a Scrapy Item to structure the output
-class ChevyItem(Item):
-    make = Field()
-    modelDisplayName = Field()
-    model = Field()
-    year = Field()
-    bodyType = Field()
-    msrp = Field()
-    image = Field()
-    bodyStyle = Field()
-    cabType = Field()
-    bedLength = Field()
-    driveType = Field()
-    trim = Field()
-    exteriorColors = Field()
-    interiorColors = Field()
-    packages = Field()
+
+from scraper.artifacts import ArtifactStore
+from scraper.browser import PageInstrumentation, PagePool, PageReadiness, ResourceBlocker, record_readiness
+from scraper.configurator import (
+    DETACH_DOCUMENT_JS,
+    EXTRACT_JS,
+    RESTORE_DOCUMENT_JS,
+    STAGE_FIELDS,
+    STAGE_SELECTORS,
+    ConfiguratorCapture,
+    ConfiguratorPageCache,
+    configurator_url,
+    extract_embedded_state,
+    extract_from_json,
+)
+from scraper.deadletter import DeadLetterQueue, letter_request, replay_requests
+from scraper.decoding import CatalogueResponse, LineResponse, TrimOptionsResponse, TrimsResponse, decode
+from scraper.items import VehicleRecord
+from scraper.shard import shard_of
+
 
 class ChevySpider(scrapy.Spider):
     name = "chevrolet"
     start_url = "https://www.chevrolet.com/shopping/configurator"
+    # Takes shard/shards arguments, see scraper.shard
+    supports_sharding = True
     headers = {
         "Dealerid": "0",
         "Oemid": "GM",
@@ -42,33 +44,63 @@ class ChevySpider(scrapy.Spider):
         "Connection": "keep-alive",
     }
 
+    # Headers for the plain HTTP configurator page loads
+    page_headers = {
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+        "Referer": "https://www.chevrolet.com/shopping/configurator",
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Accept-Language": "en-US,en;q=0.9",
+        "Accept-Encoding": "gzip, deflate, br",
+        "Connection": "keep-alive",
+    }
+
     custom_settings = {
         "PLAYWRIGHT_BROWSER_TYPE": "chromium",
-        "PLAYWRIGHT_LAUNCH_OPTIONS": {
-            "headless": False,
-            "args": [
-                "--disable-blink-features=AutomationControlled",  # Bypass bot detection
-                "--no-sandbox",
-                "--disable-dev-shm-usage",
-                "--disable-gpu",
-                "--disable-web-security",  # Relax security for testing
-                "--disable-features=IsolateOrigins,site-per-process",  # Disable strict isolation
-            ],
-        },
         "PLAYWRIGHT_DEFAULT_NAVIGATION_TIMEOUT": 60000,  # 60s timeout
         "PLAYWRIGHT_MAX_PAGES_PER_CONTEXT": 10,
+        # Skip images, fonts, media and trackers on the configurator pages
+        "PLAYWRIGHT_RESOURCE_PROFILE": "render-minimal",
+        # Read colors and packages from the configurator gateway JSON instead
+        # of the rendered DOM (falls back to the DOM when nothing is captured)
+        "CONFIGURATOR_CAPTURE": False,
+        "CONFIGURATOR_CAPTURE_TIMEOUT": 15,
+        # Try to read the configurator data from the server-rendered HTML
+        # before falling back to Playwright, and stop trying a page type after
+        # this many fallbacks without a single hit (0 keeps trying)
+        "CONFIGURATOR_FAST_PATH": True,
+        "CONFIGURATOR_FAST_PATH_GIVE_UP": 50,
+        # Extract from the full page HTML with CSS selectors instead of a
+        # single in-page evaluate, for debugging selector problems
+        "CONFIGURATOR_DEBUG_HTML": False,
+        # Enough slots for the three configurator pages of a model to load side by side
+        "CONCURRENT_REQUESTS": 6,
+        # Per-endpoint rate control (gateway calls, configurator pages),
+        # starting wide enough for the three stages of a model
+        "ADAPTIVE_RATE_ENABLED": True,
+        "ADAPTIVE_RATE_START_CONCURRENCY": 3,
         "RETRY_ENABLED": True,
         "RETRY_TIMES": 3,
-        "FEED_URI": "trim_output.csv",
-        "FEED_FORMAT": "csv",
-        "FEED_EXPORT_FIELDS": [
+        # Written once, by ColumnarExportPipeline (Parquet when pyarrow is
+        # installed, CSV otherwise), instead of a feed plus a hand-built CSV
+        "EXPORT_FILE": "enriched_output.csv",
+        "EXPORT_FIELDS": [
             "make", "modelDisplayName", "model", "year", "bodyType", "msrp", "image",
             "bodyStyle", "cabType", "bedLength", "driveType", "trim", "exteriorColors",
             "interiorColors", "packages"
         ],
+        "EXPORT_DICTIONARY_FIELDS": [
+            "make", "modelDisplayName", "model", "year", "bodyType", "bodyStyle", "cabType",
+            "bedLength", "driveType", "trim", "exteriorColors", "interiorColors", "packages"
+        ],
         "ITEM_PIPELINES": {
-            "scraper.middlewares.ChevyPipeline": 300,
+            "scraper.pipelines.DedupPipeline": 200,
+            "scraper.pipelines.ColumnarExportPipeline": 300,
         },
+        # A model can be listed under several catalogue filters; within a
+        # run every configuration is emitted once. Not kept across runs, the
+        # catalogue is re-scraped for its current prices.
+        "DEDUP_KEY_FIELDS": ["make", "model", "year", "trim", "bodyStyle", "bodyType", "cabType", "bedLength", "driveType"],
+        "DEDUP_PERSIST": False,
         "PLAYWRIGHT_CONTEXTS": {
             "default": {
                 "viewport": {"width": 1920, "height": 1080},
@@ -88,14 +120,55 @@ class ChevySpider(scrapy.Spider):
         },
     }
 
+    def __init__(self, shard=None, shards=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Set by scraper.shard when the catalogue is split across processes
+        self.shard = int(shard) if shard is not None else None
+        self.shards = int(shards) if shards is not None else 1
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.page_cache = ConfiguratorPageCache(crawler.stats)
+        spider.resource_blocker = ResourceBlocker(crawler.settings, crawler.stats)
+        spider.instrumentation = PageInstrumentation(crawler.settings, crawler.stats, spider.logger)
+        spider.artifacts = ArtifactStore.from_settings(crawler.settings, crawler.stats)
+        spider.page_pool = PagePool(crawler.settings, crawler.stats, init_page=spider.resource_blocker.init_page)
+        spider.dead_letters = DeadLetterQueue.from_crawler(crawler, spider)
+        return spider
+
     def start_requests(self):
+        if getattr(self, "replay", None):
+            yield from replay_requests(self.replay, self)
+            return
         yield scrapy.Request(
             url=self.start_url,
             method="GET",
             callback=self.after_get,
-            meta={"cookiejar": 1}
+            meta={"cookiejar": 1},
+            errback=self.handle_error,
         )
 
+    def replay_requests(self, letters):
+        # A configurator page is only useful to the trims waiting on it, so
+        # those are replayed by claiming the pages again for the stored
+        # trims, which loads all three stages once per model
+        replayed = set()
+        for letter in letters:
+            request = letter_request(letter, self)
+            key = request.cb_kwargs.get("key")
+            if key is None:
+                yield request
+                continue
+            if key in replayed:
+                continue
+            replayed.add(key)
+            for model in letter["context"].get("waiters", []):
+                entry, owner = self.page_cache.claim(model)
+                if owner:
+                    for stage in STAGE_FIELDS:
+                        yield self.configurator_request(entry.key, stage)
+
     async def after_get(self, response):
         self.logger.info("Visited GET page. Now sending POST...")
         payload = {
@@ -110,15 +183,18 @@ class ChevySpider(scrapy.Spider):
             headers=self.headers,
             body=json.dumps(payload),
             callback=self.parse_response,
-            meta={"cookiejar": 1}
+            meta={"cookiejar": 1},
+            errback=self.handle_error,
         )
 
     def parse_response(self, response):
-        parsed_response = json.loads(response.text)
+        parsed_response = decode(response.body, CatalogueResponse)
         catalogs = [x for x in parsed_response["data"]["catalogue"] if x["bodyType"] not in ["ELECTRIC", "VAN"]]
         for catalog in catalogs:
             for model in catalog["models"]:
                 for year in model["years"]:
+                    if self.shard is not None and shard_of(year["model"], year["bodyStyle"], shards=self.shards) != self.shard:
+                        continue
                     payload = {
                         "make": "chevrolet",
                         "model": year["model"],
@@ -126,19 +202,19 @@ class ChevySpider(scrapy.Spider):
                         "year": year["year"],
                         "zipCode": "48243",
                     }
-                    localModel = {
-                        "make": year["make"],
-                        "modelDisplayName": year["displayName"],
-                        "model": year["model"],
-                        "year": year["year"],
-                        "bodyType": year["bodyType"],
-                        "msrp": year["msrp"],
-                        "image": year["largeImage"],
-                        "bodyStyle": year["bodyStyle"],
-                        "cabType": "",
-                        "bedLength": "",
-                        "driveType": "",
-                    }
+                    localModel = VehicleRecord(
+                        make=year["make"],
+                        modelDisplayName=year["displayName"],
+                        model=year["model"],
+                        year=year["year"],
+                        bodyType=year["bodyType"],
+                        msrp=year["msrp"],
+                        image=year["largeImage"],
+                        bodyStyle=year["bodyStyle"],
+                        cabType="",
+                        bedLength="",
+                        driveType="",
+                    )
                     if year["navigation"][0]["key"] == "config":
                         yield scrapy.Request(
                             url="https://www.chevrolet.com/chevrolet/shopping/api/aec-cp-configurator-gateway/p/v1/line",
@@ -147,7 +223,8 @@ class ChevySpider(scrapy.Spider):
                             body=json.dumps(payload),
                             callback=self.parse_line_response,
                             cb_kwargs={"model": localModel},
-                            meta={"cookiejar": 1}
+                            meta={"cookiejar": 1},
+                            errback=self.handle_error,
                         )
                     else:
                         yield scrapy.Request(
@@ -157,30 +234,24 @@ class ChevySpider(scrapy.Spider):
                             body=json.dumps(payload),
                             callback=self.parse_trims_response,
                             cb_kwargs={"model": localModel},
-                            meta={"cookiejar": 1}
+                            meta={"cookiejar": 1},
+                            errback=self.handle_error,
                         )
 
     def parse_trims_response(self, response, model):
-        parsed_response = json.loads(response.text)
+        parsed_response = decode(response.body, TrimOptionsResponse)
         if parsed_response["data"]["trimOptions"].get("bodyType"):
             for bodyType in parsed_response["data"]["trimOptions"]["bodyType"]["options"]:
+                changes = self.body_type_changes(bodyType["description"])
                 for driveType in bodyType["driveType"]:
-                    localModel = copy.deepcopy(model)
-                    if bodyType["description"]:
-                        props = [x.strip() for x in bodyType["description"].split(",") if x]
-                        if len(props) < 2:
-                            localModel["bodyType"] = props[0]
-                        else:
-                            localModel["cabType"] = props[0]
-                            localModel["bedLength"] = props[1]
-                    localModel["driveType"] = driveType["id"]
+                    localModel = model.replace(driveType=driveType["id"], **changes)
                     payload = {
-                        "make": localModel["make"],
-                        "model": localModel["model"],
-                        "bodyStyle": localModel["bodyStyle"],
-                        "year": localModel["year"],
+                        "make": localModel.make,
+                        "model": localModel.model,
+                        "bodyStyle": localModel.bodyStyle,
+                        "year": localModel.year,
                         "zipCode": "48243",
-                        "driveTypeId": localModel["driveType"],
+                        "driveTypeId": localModel.driveType,
                         "bodyTypeId": bodyType["bodyTypeID"],
                     }
                     yield scrapy.Request(
@@ -190,32 +261,29 @@ class ChevySpider(scrapy.Spider):
                         body=json.dumps(payload),
                         callback=self.parse_deep_trims_response,
                         cb_kwargs={"model": localModel},
-                        meta={"cookiejar": 1}
+                        meta={"cookiejar": 1},
+                        errback=self.handle_error,
                     )
 
     def parse_line_response(self, response, model):
-        parsed_response = json.loads(response.text)
+        parsed_response = decode(response.body, LineResponse)
         if parsed_response["data"]["bodyTypes"]:
             for bodyType in parsed_response["data"]["bodyTypes"]:
+                changes = self.body_type_changes(bodyType["description"])
                 for driveType in bodyType["driveTypes"]:
-                    localModel = copy.deepcopy(model)
-                    if bodyType["description"]:
-                        props = [x.strip() for x in bodyType["description"].split(",") if x]
-                        if len(props) < 2:
-                            localModel["bodyType"] = props[0]
-                        else:
-                            localModel["cabType"] = props[0]
-                            localModel["bedLength"] = props[1]
-                    localModel["driveType"] = driveType["driveType"]
-                    localModel["image"] = bodyType["imageUrl"]
-                    localModel["msrp"] = bodyType["msrp"]["value"]
+                    localModel = model.replace(
+                        driveType=driveType["driveType"],
+                        image=bodyType["imageUrl"],
+                        msrp=bodyType["msrp"]["value"],
+                        **changes
+                    )
                     payload = {
-                        "make": localModel["make"],
-                        "model": localModel["model"],
-                        "bodyStyle": localModel["bodyStyle"],
-                        "year": localModel["year"],
+                        "make": localModel.make,
+                        "model": localModel.model,
+                        "bodyStyle": localModel.bodyStyle,
+                        "year": localModel.year,
                         "zipCode": "48243",
-                        "driveTypeId": localModel["driveType"],
+                        "driveTypeId": localModel.driveType,
                         "bodyTypeId": bodyType["id"],
                     }
                     yield scrapy.Request(
@@ -225,151 +293,265 @@ class ChevySpider(scrapy.Spider):
                         body=json.dumps(payload),
                         callback=self.parse_deep_trims_response,
                         cb_kwargs={"model": localModel},
-                        meta={"cookiejar": 1}
+                        meta={"cookiejar": 1},
+                        errback=self.handle_error,
                     )
 
+    @staticmethod
+    def body_type_changes(description):
+        # "Crew Cab, Short Bed" -> cab and bed, anything else is the body type
+        if not description:
+            return {}
+        props = [x.strip() for x in description.split(",") if x]
+        if len(props) < 2:
+            return {"bodyType": props[0]}
+        return {"cabType": props[0], "bedLength": props[1]}
+
     def parse_deep_trims_response(self, response, model):
-        localModel = copy.deepcopy(model)
-        parsed_response = json.loads(response.text)
-        for trim in parsed_response["data"]["trims"]:
-            localModel["image"] = parsed_response["data"]["trims"][trim]["imageUrl"]
-            localModel["trim"] = parsed_response["data"]["trims"][trim]["name"]
-            if parsed_response["data"]["trims"][trim].get("msrp"):
-                localModel["msrp"] = parsed_response["data"]["trims"][trim]["msrp"]["value"]
-
-
-            # Trigger exterior colors request
-            url = f"https://www.chevrolet.com/shopping/configurator/{localModel['bodyType']}/{localModel['year']}/{localModel['model']}/{localModel['bodyStyle']}/exterior?buildCode=&radius=250&zipCode=48243"
-            yield scrapy.Request(
-                url=url,
+        parsed_response = decode(response.body, TrimsResponse)
+        for trim in parsed_response["data"]["trims"].values():
+            changes = {"image": trim["imageUrl"], "trim": trim["name"]}
+            if trim.get("msrp"):
+                changes["msrp"] = trim["msrp"]["value"]
+            localModel = model.replace(**changes)
+
+            # The configurator pages are shared by every trim of the model, so
+            # only the first trim loads them and the others reuse the result
+            entry, owner = self.page_cache.claim(localModel)
+            if entry.done:
+                yield self.build_item(localModel, entry.data)
+            elif owner:
+                # The exterior, interior and options pages don't depend on
+                # each other, so all three are requested at once
+                for stage in STAGE_FIELDS:
+                    yield self.configurator_request(entry.key, stage)
+
+    def configurator_request(self, key, stage):
+        # Try the server-rendered HTML first, a browser render is only needed
+        # when the page doesn't embed the data
+        if self.settings.getbool("CONFIGURATOR_FAST_PATH") and not self.fast_path_disabled(stage):
+            return scrapy.Request(
+                url=configurator_url(key, stage),
                 method="GET",
-                headers=self.headers,
-                callback=self.parse_exterior_response,
-                cb_kwargs={"model": localModel},
-                meta={
-                    "playwright": True,
-                    "playwright_include_page": True,
-                    "playwright_context": "default",
-                    "playwright_page_close": True,
-                    "playwright_context_kwargs": {
-                        "viewport": {"width": 1920, "height": 1080},
-                        "user_agent": self.headers["User-Agent"],
-                        "locale": "en-US",
-                        "timezone_id": "America/New_York",
-                        "permissions": ["geolocation"],
-                        "java_script_enabled": True,
-                        "ignore_https_errors": True,
-                        "bypass_csp": True,
-                    },
-                    "playwright_page_methods": [
-                        PageMethod("goto", url, wait_until="domcontentloaded", timeout=30000),  # Reduced initial timeout
-                        PageMethod("wait_for_timeout", 2000),  # Wait for initial render
-                        PageMethod("evaluate", "window.scrollTo(0, document.body.scrollHeight)"),  # Scroll to trigger lazy loading
-                        PageMethod("wait_for_timeout", 2000),  # Wait for dynamic content
-                        PageMethod("wait_for_selector", "div.configuratorControlPanelSectionOptionsV1_optionsContainer__wkZjs", timeout=30000, state="attached"),  # Relaxed selector wait
-                        PageMethod("screenshot", path=f"screenshots/chevy_{uuid.uuid4()}.png", full_page=True),
-                    ],
-                    "playwright_page_event_handlers": {
-                        "console": lambda msg: self.logger.info(f"Console: {msg.text}"),
-                        "pageerror": lambda err: self.logger.error(f"Page error: {err}"),
-                        "request": lambda req: self.logger.debug(f"Request: {req.url}"),
-                        "response": lambda res: self.logger.debug(f"Response: {res.url} {res.status}"),
-                        "requestfailed": lambda req: self.logger.error(f"Request failed: {req.url}"),
-                    },
-                    "cookiejar": 1,
-                },
+                headers=self.page_headers,
+                callback=self.parse_configurator_state,
+                cb_kwargs={"key": key, "stage": stage},
+                meta={"cookiejar": 1},
                 errback=self.handle_error,
             )
+        return self.configurator_browser_request(key, stage)
 
-    async def parse_exterior_response(self, response, model):
-        self.logger.info(f"Processing exterior URL: {response.url}")
-        localModel = copy.deepcopy(model)
+    def fast_path_disabled(self, stage):
+        # Stop trying a page type that never embeds its data
+        stats = self.crawler.stats
+        give_up = self.settings.getint("CONFIGURATOR_FAST_PATH_GIVE_UP", 0)
+        return (
+            give_up > 0
+            and not stats.get_value(f"configurator/fast_path/{stage}/hit", 0)
+            and stats.get_value(f"configurator/fast_path/{stage}/fallback", 0) >= give_up
+        )
 
-        page = response.meta["playwright_page"]
-        content = await page.content()
-        self.logger.debug(f"Page content for {response.url}: {content[:1000]}...")
+    def parse_configurator_state(self, response, key, stage):
+        try:
+            extracted_data = extract_from_json(extract_embedded_state(response), stage)
+        except Exception as e:
+            # Unexpected embedded state is handled like no state at all
+            self.logger.warning(f"Embedded {stage} state on {response.url} couldn't be read: {e!r}")
+            extracted_data = None
+        if not extracted_data:
+            self.crawler.stats.inc_value(f"configurator/fast_path/{stage}/fallback")
+            self.logger.debug(f"No embedded {stage} data on {response.url}, rendering with Playwright")
+            yield self.configurator_browser_request(key, stage)
+            return
+        self.crawler.stats.inc_value(f"configurator/fast_path/{stage}/hit")
+        self.logger.info(f"Extracted {stage} data without a browser: {extracted_data}")
+        yield from self.stage_done(key, stage, extracted_data)
 
-        extracted_data = []
-        if not response.css("div.configuratorControlPanelSectionOptionsV1_optionsContainer__wkZjs"):
-            self.logger.warning(f"Target div not found on {response.url}")
-            # Attempt to extract data with fallback selector or log DOM state
-            fallback_elements = response.css("div[class*='optionsContainer']")  # Broader selector
-            if fallback_elements:
-                self.logger.info(f"Fallback selector found {len(fallback_elements)} elements")
-                for element in fallback_elements:
-                    name = element.css("p[class*='title']::text").get(default="No name").strip()
-                    price = element.css("div[class*='pricing']::text").get(default="No price").strip()
-                    extracted_data.append({"name": name, "price": price})
-        else:
-            options = response.css("div.configuratorControlPanelSectionOptionsV1_optionsContainer__wkZjs div.configuratorControlPanelSectionOptionV1_container__tKC_W")
-            for option in options:
-                image_url = option.css("div.productImageV1_imageContainer__otCnJ img::attr(src)").get(default="No image")
-                name = option.css("p.configuratorControlPanelSectionOptionV1_title__C78__::text").get(default="No name")
-                price = option.css("div.imageSwatchPricing_pricing__HzkIR::text").get(default="No price")
-                extracted_data.append({
-                    "image_url": image_url,
-                    "name": name.strip() if name else "No name",
-                    "price": price.strip() if price else "No price",
-                })
-        localModel["exteriorColors"] = extracted_data
-        self.logger.info(f"Extracted exterior data: {extracted_data}")
+    def stage_done(self, key, stage, extracted_data):
+        # The item is assembled once the last of the three pages is in;
+        # extracted_data is None for a page that failed
+        if self.page_cache.stage_done(key, stage, extracted_data):
+            # Yield the final enriched item for every trim sharing these pages
+            yield from self.finish_configurator(key)
 
-        await page.close()
+    def stage_failed(self, request, key, stage, reason):
+        # Keeps the page in the dead letters (with the trims that waited on
+        # it) and releases those trims with what the other pages gave
+        entry = self.page_cache.get(key)
+        self.dead_letters.add(request, self, reason, {"waiters": list(entry.waiters) if entry else []})
+        yield from self.stage_done(key, stage, None)
 
-        url = f"https://www.chevrolet.com/shopping/configurator/{localModel['bodyType']}/{localModel['year']}/{localModel['model']}/{localModel['bodyStyle']}/interior?buildCode=&radius=250&zipCode=48243"
-        yield scrapy.Request(
+    def configurator_browser_request(self, key, stage):
+        callback = {
+            "exterior": self.parse_exterior_response,
+            "interior": self.parse_interior_response,
+            "options": self.parse_packages_response,
+        }[stage]
+        url = configurator_url(key, stage)
+        meta = {
+            "playwright": True,
+            "playwright_include_page": True,
+            "playwright_context": "default",
+            "playwright_page_close": True,
+            "playwright_page_init_callback": self.page_pool.init_page,
+            "playwright_context_kwargs": {
+                "viewport": {"width": 1920, "height": 1080},
+                "user_agent": self.headers["User-Agent"],
+                "locale": "en-US",
+                "timezone_id": "America/New_York",
+                "permissions": ["geolocation"],
+                "java_script_enabled": True,
+                "ignore_https_errors": True,
+                "bypass_csp": True,
+            },
+            "playwright_page_goto_kwargs": {"wait_until": "domcontentloaded", "timeout": 30000},
+            "playwright_page_methods": [
+                # Returns as soon as the options are attached and the page has settled
+                PageReadiness.from_settings(self.settings, selector=STAGE_SELECTORS[stage]).page_method(),
+            ],
+            "playwright_page_event_handlers": self.instrumentation.event_handlers(),
+            "configurator_stage": stage,
+            "cookiejar": 1,
+        }
+        if self.settings.getbool("CONFIGURATOR_CAPTURE"):
+            # Record the gateway JSON the page fetches for itself; the data is
+            # read from there, so there is no DOM to wait for
+            capture = ConfiguratorCapture(forward=meta["playwright_page_event_handlers"].get("response"))
+            meta["configurator_capture"] = capture
+            meta["playwright_page_methods"] = []
+            meta["resource_profile"] = "data-only"
+            meta["playwright_page_event_handlers"]["response"] = capture.on_response
+        if not self.settings.getbool("CONFIGURATOR_DEBUG_HTML"):
+            # The callback reads the live page, the response body isn't used
+            meta["playwright_page_methods"].append(PageMethod("evaluate", DETACH_DOCUMENT_JS))
+        # Pages are reused between configurator requests with the same
+        # resource profile (PagePoolMiddleware picks the page and context)
+        meta["page_pool"] = f"configurator-{meta.get('resource_profile', self.resource_blocker.default_profile)}"
+        return scrapy.Request(
             url=url,
             method="GET",
             headers=self.headers,
-            callback=self.parse_interior_response,
-            cb_kwargs={"model": localModel},
-            meta={
-                "playwright": True,
-                "playwright_include_page": True,
-                "playwright_context": "default",
-                "playwright_page_close": True,
-                "playwright_context_kwargs": {
-                    "viewport": {"width": 1920, "height": 1080},
-                    "user_agent": self.headers["User-Agent"],
-                    "locale": "en-US",
-                    "timezone_id": "America/New_York",
-                    "permissions": ["geolocation"],
-                    "java_script_enabled": True,
-                    "ignore_https_errors": True,
-                    "bypass_csp": True,
-                },
-                "playwright_page_methods": [
-                    PageMethod("goto", url, wait_until="domcontentloaded", timeout=30000),
-                    PageMethod("wait_for_timeout", 2000),
-                    PageMethod("evaluate", "window.scrollTo(0, document.body.scrollHeight)"),
-                    PageMethod("wait_for_timeout", 2000),
-                    PageMethod("wait_for_selector", "div.configuratorControlPanelSectionOptionsV1_optionsContainer__wkZjs", timeout=30000, state="attached"),
-                    PageMethod("screenshot", path=f"screenshots/chevy_{uuid.uuid4()}.png", full_page=True),
-                ],
-                "playwright_page_event_handlers": {
-                    "console": lambda msg: self.logger.info(f"Console: {msg.text}"),
-                    "pageerror": lambda err: self.logger.error(f"Page error: {err}"),
-                    "request": lambda req: self.logger.debug(f"Request: {req.url}"),
-                    "response": lambda res: self.logger.debug(f"Response: {res.url} {res.status}"),
-                    "requestfailed": lambda req: self.logger.error(f"Request failed: {req.url}"),
-                },
-                "cookiejar": 1,
-            },
+            callback=callback,
+            cb_kwargs={"key": key},
+            meta=meta,
             errback=self.handle_error,
+            dont_filter=True,
         )
 
-    async def parse_interior_response(self, response, model):
+    def build_item(self, model, data):
+        # Colors and packages are shared between trims, so they are referenced
+        # rather than copied into every item
+        return model.replace(**data)
+
+    def finish_configurator(self, key):
+        entry, waiters = self.page_cache.resolve(key)
+        for model in waiters:
+            yield self.build_item(model, entry.data)
+
+    async def parse_exterior_response(self, response, key):
+        self.logger.info(f"Processing exterior URL: {response.url}")
+
+        async for result in self.parse_stage(response, key, "exterior"):
+            yield result
+
+    async def parse_interior_response(self, response, key):
         self.logger.info(f"Processing interior URL: {response.url}")
-        localModel = copy.deepcopy(model)
 
+        async for result in self.parse_stage(response, key, "interior"):
+            yield result
+
+    async def parse_packages_response(self, response, key):
+        self.logger.info(f"Processing packages URL: {response.url}")
+
+        async for result in self.parse_stage(response, key, "options"):
+            yield result
+
+    async def parse_stage(self, response, key, stage):
+        # The errback only sees download failures; a page that fails while
+        # it is read here is marked done all the same, so the trims waiting
+        # on it still come out
+        try:
+            extracted_data = await self.extract_stage(response, stage)
+        except Exception as e:
+            self.logger.error(f"Extracting {stage} data from {response.url} failed: {e!r}")
+            for result in self.stage_failed(response.request, key, stage, repr(e)):
+                yield result
+            return
+        self.logger.info(f"Extracted {stage} data: {extracted_data}")
+
+        for result in self.stage_done(key, stage, extracted_data):
+            yield result
+
+    async def extract_stage(self, response, stage):
         page = response.meta["playwright_page"]
-        content = await page.content()
-        self.logger.debug(f"Page content for {response.url}: {content[:1000]}...")
+        readiness = record_readiness(response, stage, self.crawler.stats)
+        capture = response.meta.get("configurator_capture")
+        # First thing that went wrong on the page, the artifacts are kept under it
+        reason = None
+        reuse = False
+        try:
+            if not self.settings.getbool("CONFIGURATOR_DEBUG_HTML"):
+                await page.evaluate(RESTORE_DOCUMENT_JS)
+            if readiness is not None and not readiness["ready"]:
+                reason = "not_ready"
+            if capture is not None:
+                await capture.wait(timeout=self.settings.getfloat("CONFIGURATOR_CAPTURE_TIMEOUT", 15))
+                extracted_data = extract_from_json(capture.payloads, stage)
+                if extracted_data:
+                    self.crawler.stats.inc_value(f"configurator/capture/{stage}/hit")
+                    reuse = True
+                    return extracted_data
+                # Nothing usable came over the wire, let the page render and
+                # fall back to the DOM
+                self.crawler.stats.inc_value(f"configurator/capture/{stage}/miss")
+                self.logger.warning(f"No configurator JSON captured on {response.url}, falling back to DOM")
+                reason = reason or "capture_miss"
+                try:
+                    await page.wait_for_selector(STAGE_SELECTORS[stage], timeout=30000, state="attached")
+                except playwright._impl._errors.Error as e:
+                    self.logger.warning(f"Selector wait failed on {response.url}: {e}")
+            if not self.settings.getbool("CONFIGURATOR_DEBUG_HTML"):
+                # Collect the options inside the page, only the compact result
+                # comes back over the CDP pipe
+                result = await page.evaluate(EXTRACT_JS, {"stage": stage})
+                fallback, extracted_data = result["fallback"], result["records"]
+                if fallback:
+                    self.logger.warning(f"Target elements not found on {response.url}, fallback selector found {len(extracted_data)} elements")
+            else:
+                # Debug path: serialise the whole DOM and parse it again with lxml
+                content = await page.content()
+                self.logger.debug(f"Page content for {response.url}: {content[:1000]}...")
+                selector = Selector(text=content)
+                if stage == "options":
+                    fallback = not selector.css("#packages_options div.drp-grid-item")
+                    extracted_data = self.parse_package_cards(selector, response.url)
+                else:
+                    fallback = not selector.css(STAGE_SELECTORS[stage])
+                    extracted_data = self.parse_color_options(selector, response.url)
+            if fallback or not extracted_data:
+                reason = reason or "fallback"
+            reuse = True
+            return extracted_data
+        except Exception:
+            reason = reason or "error"
+            raise
+        finally:
+            # One screenshot and HTML per page: pages something went wrong
+            # on, plus a sample of the ones that went fine
+            if reason is not None:
+                await self.artifacts.capture(page, stage, reason)
+            elif self.artifacts.sampled():
+                await self.artifacts.capture(page, stage, "sample")
+            # Hand the page back to the pool instead of closing it, unless
+            # reading it failed
+            await self.page_pool.release(page, response.request, reuse=reuse)
 
+    def parse_color_options(self, selector, url):
         extracted_data = []
-        if not response.css("div.configuratorControlPanelSectionOptionsV1_optionsContainer__wkZjs"):
-            self.logger.warning(f"Target div not found on {response.url}")
-            fallback_elements = response.css("div[class*='optionsContainer']")
+        if not selector.css("div.configuratorControlPanelSectionOptionsV1_optionsContainer__wkZjs"):
+            self.logger.warning(f"Target div not found on {url}")
+            # Attempt to extract data with fallback selector or log DOM state
+            fallback_elements = selector.css("div[class*='optionsContainer']")  # Broader selector
             if fallback_elements:
                 self.logger.info(f"Fallback selector found {len(fallback_elements)} elements")
                 for element in fallback_elements:
@@ -377,7 +559,7 @@ class ChevySpider(scrapy.Spider):
                     price = element.css("div[class*='pricing']::text").get(default="No price").strip()
                     extracted_data.append({"name": name, "price": price})
         else:
-            options = response.css("div.configuratorControlPanelSectionOptionsV1_optionsContainer__wkZjs div.configuratorControlPanelSectionOptionV1_container__tKC_W")
+            options = selector.css("div.configuratorControlPanelSectionOptionsV1_optionsContainer__wkZjs div.configuratorControlPanelSectionOptionV1_container__tKC_W")
             for option in options:
                 image_url = option.css("div.productImageV1_imageContainer__otCnJ img::attr(src)").get(default="No image")
                 name = option.css("p.configuratorControlPanelSectionOptionV1_title__C78__::text").get(default="No name")
@@ -387,66 +569,14 @@ class ChevySpider(scrapy.Spider):
                     "name": name.strip() if name else "No name",
                     "price": price.strip() if price else "No price",
                 })
-        localModel["interiorColors"] = extracted_data
-        self.logger.info(f"Extracted interior data: {extracted_data}")
-
-        await page.close()
-
-        url = f"https://www.chevrolet.com/shopping/configurator/{localModel['bodyType']}/{localModel['year']}/{localModel['model']}/{localModel['bodyStyle']}/options?buildCode=&radius=250&zipCode=48243"
-        yield scrapy.Request(
-            url=url,
-            method="GET",
-            headers=self.headers,
-            callback=self.parse_packages_response,
-            cb_kwargs={"model": localModel},
-            meta={
-                "playwright": True,
-                "playwright_include_page": True,
-                "playwright_context": "default",
-                "playwright_page_close": True,
-                "playwright_context_kwargs": {
-                    "viewport": {"width": 1920, "height": 1080},
-                    "user_agent": self.headers["User-Agent"],
-                    "locale": "en-US",
-                    "timezone_id": "America/New_York",
-                    "permissions": ["geolocation"],
-                    "java_script_enabled": True,
-                    "ignore_https_errors": True,
-                    "bypass_csp": True,
-                },
-                "playwright_page_methods": [
-                    PageMethod("goto", url, wait_until="domcontentloaded", timeout=30000),
-                    PageMethod("wait_for_timeout", 2000),
-                    PageMethod("evaluate", "window.scrollTo(0, document.body.scrollHeight)"),
-                    PageMethod("wait_for_timeout", 2000),
-                    PageMethod("wait_for_selector", "div#packages_options", timeout=30000, state="attached"),
-                    PageMethod("screenshot", path=f"screenshots/chevy_{uuid.uuid4()}.png", full_page=True),
-                ],
-                "playwright_page_event_handlers": {
-                    "console": lambda msg: self.logger.info(f"Console: {msg.text}"),
-                    "pageerror": lambda err: self.logger.error(f"Page error: {err}"),
-                    "request": lambda req: self.logger.debug(f"Request: {req.url}"),
-                    "response": lambda res: self.logger.debug(f"Response: {res.url} {res.status}"),
-                    "requestfailed": lambda req: self.logger.error(f"Request failed: {req.url}"),
-                },
-                "cookiejar": 1,
-            },
-            errback=self.handle_error,
-        )
-
-    async def parse_packages_response(self, response, model):
-        self.logger.info(f"Processing packages URL: {response.url}")
-        localModel = copy.deepcopy(model)
-
-        page = response.meta["playwright_page"]
-        content = await page.content()
-        self.logger.debug(f"Page content for {response.url}: {content[:1000]}...")
+        return extracted_data
 
+    def parse_package_cards(self, selector, url):
         extracted_packages = []
-        packages = response.css('#packages_options div.drp-grid-item')
+        packages = selector.css('#packages_options div.drp-grid-item')
         if not packages:
-            self.logger.warning(f"No packages found on {response.url}")
-            fallback_elements = response.css("div[class*='options']")
+            self.logger.warning(f"No packages found on {url}")
+            fallback_elements = selector.css("div[class*='options']")
             if fallback_elements:
                 self.logger.info(f"Fallback selector found {len(fallback_elements)} elements")
                 for element in fallback_elements:
@@ -463,16 +593,7 @@ class ChevySpider(scrapy.Spider):
                     'options': options,
                     'price': price
                 })
-        localModel['packages'] = extracted_packages
-        self.logger.info(f"Extracted packages: {extracted_packages}")
-
-        await page.close()
-
-        # Yield the final enriched item
-        item = ChevyItem()
-        for key, value in localModel.items():
-            item[key] = value
-        yield item
+        return extracted_packages
 
     async def handle_error(self, failure):
         self.logger.error(f"Request failed: {failure}")
@@ -480,6 +601,22 @@ class ChevySpider(scrapy.Spider):
             self.logger.error(f"Playwright error: {failure.value}")
         if "playwright_page" in failure.request.meta:
             page = failure.request.meta["playwright_page"]
-            content = await page.content()
-            self.logger.debug(f"Error page content: {content[:1000]}...")
-            await page.close()
+            if not page.is_closed():
+                content = await page.content()
+                self.logger.debug(f"Error page content: {content[:1000]}...")
+                await self.artifacts.capture(page, failure.request.meta.get("configurator_stage", "page"), "error")
+            await self.page_pool.release(page, failure.request, reuse=False)
+        key = failure.request.cb_kwargs.get("key")
+        stage = failure.request.meta.get("configurator_stage", failure.request.cb_kwargs.get("stage"))
+        if stage is None:
+            self.dead_letters.add(failure.request, self, repr(failure.value))
+            return
+        # A failed plain HTTP load still gets a chance in the browser
+        if not failure.request.meta.get("playwright"):
+            self.crawler.stats.inc_value(f"configurator/fast_path/{stage}/fallback")
+            yield self.configurator_browser_request(key, stage)
+            return
+        # A failed page doesn't hold back the others: once they are in, the
+        # trims are released with whatever was extracted
+        for item in self.stage_failed(failure.request, key, stage, repr(failure.value)):
+            yield item
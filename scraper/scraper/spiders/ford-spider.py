@@ -1,5 +1,3 @@
-import json
-import re
 import uuid
 
 import scrapy
@@ -7,6 +5,8 @@ from scrapy.crawler import CrawlerProcess
 from scrapy.settings import Settings
 from scrapy_playwright.page import PageMethod
 
+from scraper.jsextract import extract_assignment
+
 
 class FordSpider(scrapy.Spider):
     name = 'ford'
@@ -54,23 +54,15 @@ class FordSpider(scrapy.Spider):
         # Get the raw JavaScript content from the response
         js_content = response.text
         self.logger.info(js_content)
-        # Use regex to find the vdmActiveNameplates variable
-        pattern = r'var vdmActiveNameplates = ({.*?});'
-        match = re.search(pattern, js_content, re.DOTALL)
-
-        if match:
-            # Extract the JSON string
-            json_str = match.group(1)
-            try:
-                # Parse the JSON string into a Python dictionary
-                vdm_active_nameplates = json.loads(json_str)
+        try:
+            # Scans from the assignment to its matching brace in one pass
+            vdm_active_nameplates = extract_assignment(response.body, "vdmActiveNameplates")
+        except ValueError as e:
+            self.logger.error(f"Could not extract vdmActiveNameplates from the response: {e}")
+            return
 
-                # Yield or process the JSON data as needed
-                yield {'vdmActiveNameplates': vdm_active_nameplates}
-            except json.JSONDecodeError as e:
-                self.logger.error(f"Failed to parse JSON: {e}")
-        else:
-            self.logger.error("Could not find vdmActiveNameplates in the response")
+        # Yield or process the JSON data as needed
+        yield {'vdmActiveNameplates': vdm_active_nameplates}
 
 
 # settings = Settings()
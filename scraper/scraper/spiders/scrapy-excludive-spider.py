@@ -1,9 +1,16 @@
+import math
+import sys
+import time
+
 import scrapy
-import json
-import re
-from datetime import datetime
+from scrapy import signals
 from urllib.parse import urlparse
 
+from scraper.ddc import FastPathState, JsonInventorySource, dealer_of, match_vehicles, read_cards
+from scraper.deadletter import DeadLetterQueue, replay_requests
+from scraper.items import DealerListing
+from scraper.jsextract import extract_assignment
+
 class ScrapyExclusiveSpider(scrapy.Spider):
     name = "ddcContent"
     start_urls = [
@@ -11,124 +18,256 @@ class ScrapyExclusiveSpider(scrapy.Spider):
         'https://www.napletonacura.com/new-inventory/index.htm',
     ]
 
+    custom_settings = {
+        # Every dealer is its own host, so many run side by side while
+        # AdaptiveRateMiddleware keeps each one to a couple of requests
+        "CONCURRENT_REQUESTS": 128,
+        "ADAPTIVE_RATE_ENABLED": True,
+        "ADAPTIVE_RATE_MAX_CONCURRENCY": 2,
+        # Hands out requests across download slots so one big dealer can't
+        # fill the downloader while the others wait
+        "SCHEDULER_PRIORITY_QUEUE": "scrapy.pqueues.DownloaderAwarePriorityQueue",
+        # Ask the dealer's JSON inventory API first, falling back to the
+        # HTML pages for dealers that don't have it. The outcome per dealer
+        # is kept in DDC_FAST_PATH_STATE for the next runs.
+        "DDC_JSON_FAST_PATH": True,
+        "DDC_JSON_PAGE_SIZE": 100,
+        "DDC_FAST_PATH_STATE": "output/ddc_fast_path.json",
+        # Dealer groups list the same VIN on several sites, each VIN is
+        # emitted once per run
+        "ITEM_PIPELINES": {
+            "scraper.pipelines.DedupPipeline": 200,
+            "scraper.pipelines.ColumnarExportPipeline": 300,
+        },
+        "EXPORT_FILE": "output/ddc_inventory.csv",
+        "EXPORT_FIELDS": [
+            "Make", "Model", "Trim", "Year", "VIN", "MSRP", "FuelType", "BodyStyle", "Engine",
+            "Transmission", "ExteriorColor", "ExteriorColorGeneric", "InteriorColor",
+            "InteriorColorGeneric", "DriveTrain", "NumberOfDoors", "CityMPG", "HighwayMPG",
+            "Features", "Image", "Link", "Source", "CollectedFrom", "Style"
+        ],
+        "EXPORT_DICTIONARY_FIELDS": [
+            "Make", "Model", "Trim", "Year", "FuelType", "BodyStyle", "Engine", "Transmission",
+            "ExteriorColor", "InteriorColor", "DriveTrain", "NumberOfDoors", "Source", "CollectedFrom", "Style"
+        ],
+    }
+
+    def __init__(self, urls=None, *args, **kwargs):
+        # Fleet mode: `-a urls=dealers.txt` (or `-a urls=-` for stdin) crawls
+        # every inventory URL listed there, one per line, optionally followed
+        # by the dealer's item count from an earlier run. The count is only
+        # the request priority, and start requests are pulled from the file
+        # lazily, so it just orders the few dealers waiting in the scheduler
+        # at a time. For big dealers to start first, sort the file by count:
+        #
+        #     sort -k2,2nr dealers.txt | scrapy crawl ddcContent -a urls=-
+        super().__init__(*args, **kwargs)
+        self.urls = urls
+        self.dealer_started = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        settings = crawler.settings
+        spider.fast_path = FastPathState(settings.get("DDC_FAST_PATH_STATE"))
+        spider.json_source = JsonInventorySource(
+            settings.get("DDC_JSON_ENDPOINT", JsonInventorySource.ENDPOINT),
+            page_size=settings.getint("DDC_JSON_PAGE_SIZE", 100),
+        )
+        crawler.signals.connect(spider.fast_path.save, signal=signals.spider_closed)
+        spider.dead_letters = DeadLetterQueue.from_crawler(crawler, spider)
+        return spider
+
     def start_requests(self):
+        if getattr(self, 'replay', None):
+            yield from replay_requests(self.replay, self)
+            return
+        if self.urls:
+            yield from self.fleet_requests()
+            return
         for start_url in self.start_urls:
-            yield scrapy.Request(
-                start_url,
-                callback=self.parse_initial_request,
-                errback=self.errback_httpbin
+            yield self.inventory_request(start_url)
+
+    def inventory_request(self, url, priority=0):
+        if self.settings.getbool("DDC_JSON_FAST_PATH") and self.fast_path.get(dealer_of(url)) != "html":
+            return scrapy.Request(
+                self.json_source.url(url),
+                callback=self.parse_inventory_json,
+                errback=self.inventory_json_failed,
+                cb_kwargs={"inventory_url": url, "first": True},
+                priority=priority,
             )
+        return self.html_request(url, priority)
+
+    def html_request(self, url, priority=0):
+        return scrapy.Request(
+            url,
+            callback=self.parse_initial_request,
+            errback=self.errback_httpbin,
+            priority=priority,
+        )
+
+    def fleet_requests(self):
+        # A generator, so Scrapy only reads as many lines as it has room
+        # for and the list is never held in memory
+        source = sys.stdin if self.urls == "-" else open(self.urls, encoding="utf-8")
+        try:
+            for line in source:
+                parts = line.split()
+                if not parts or parts[0].startswith("#"):
+                    continue
+                total_items = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+                self.crawler.stats.inc_value('fleet/dealers')
+                yield self.inventory_request(parts[0], priority=total_items)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+    def parse_inventory_json(self, response, inventory_url, first=False):
+        parsed = self.json_source.parse(response.body)
+        # An empty first page is no proof the API works for this dealer (the
+        # endpoint may just be the wrong one), so only a page with vehicles
+        # makes it the dealer's source
+        if parsed is None or (first and not parsed[0]):
+            if first:
+                yield self.html_fallback(inventory_url, response.request.priority)
+            else:
+                self.dead_letters.add(response.request, self, "not an inventory payload")
+            return
+        vehicles, total = parsed
+        if first:
+            self.fast_path.set(dealer_of(inventory_url), "json")
+            self.crawler.stats.inc_value('ddc/fast_path/json')
+        self.dealer_stats(response, len(vehicles))
+        for vehicle in vehicles:
+            yield self.json_source.record(vehicle, inventory_url)
+        if first:
+            for url in self.json_source.page_urls(inventory_url, total):
+                yield scrapy.Request(
+                    url,
+                    callback=self.parse_inventory_json,
+                    errback=self.errback_httpbin,
+                    cb_kwargs={"inventory_url": inventory_url},
+                    priority=total,
+                )
+
+    def inventory_json_failed(self, failure):
+        request = failure.request
+        yield self.html_fallback(request.cb_kwargs["inventory_url"], request.priority)
+
+    def html_fallback(self, inventory_url, priority):
+        self.fast_path.set(dealer_of(inventory_url), "html")
+        self.crawler.stats.inc_value('ddc/fast_path/html')
+        return self.html_request(inventory_url, priority)
+
+    def dealer_stats(self, response, items):
+        dealer = dealer_of(response.url)
+        now = time.time()
+        started = self.dealer_started.setdefault(dealer, now - response.meta.get('download_latency', 0))
+        stats = self.crawler.stats
+        stats.inc_value(f'dealer/{dealer}/pages')
+        stats.inc_value(f'dealer/{dealer}/items', items)
+        stats.set_value(f'dealer/{dealer}/seconds', round(now - started, 2))
 
     def parse_initial_request(self, response):
-        script_data = response.xpath('//div[contains(@class, "tracking-ddc-data-layer")]/script/text()').get()
-        script_data = script_data.split("DDC.dataLayer['vehicles'] = ")[1]
-        script_data = script_data.split(";\nDDC.dataLayer['confirmation']")[0]
-        script_data = re.sub(r'(?<=\w)\\-(?=\w)', '-', script_data)
-        script_data = re.sub(r'(?<=\w)\\x(?=\w)', '-', script_data)
-        script_data = json.loads(script_data)
-
-        total_pages = response.xpath('//ul[contains(@class, "pagination")]//a[@data-total-items]/@data-total-items').get()
-        #yield self.get_data(response)
-        data = response.xpath('//ul[contains(@class, "inventoryList")]/li[contains(@class, "item")]')
-        key = -1
-        for vehicle in data:
-            key += 1
-            yield self.get_data(response, vehicle, script_data[key])
-
-        if int(total_pages) > 1:
-            offset = int(response.xpath('//ul[contains(@class, "pagination")]//a[@data-total-items]/@href').get().replace('?start=', '').replace('&', ''))
+        script_data = self.data_layer_vehicles(response)
+
+        total_items = response.xpath('//ul[contains(@class, "pagination")]//a[@data-total-items]/@data-total-items').get()
+        cards = read_cards(response.selector.root)
+        self.dealer_stats(response, len(cards))
+        for card, vehicle in match_vehicles(cards, script_data, self.crawler.stats):
+            yield self.get_data(response, card, vehicle)
+
+        next_href = response.xpath('//ul[contains(@class, "pagination")]//a[@data-total-items]/@href').get()
+        if total_items and next_href:
+            offset = int(next_href.replace('?start=', '').replace('&', ''))
             limit = offset
-            for page in range(1, int(total_pages)):
+            total_pages = math.ceil(int(total_items) / limit) if limit else 1
+            for page in range(1, total_pages):
                 next_page = response.url + f"?start={offset}"
+                # Dealers with more inventory go first, so the long tails
+                # are already running when the small dealers are done
                 yield scrapy.Request(
                     next_page,
                     callback=self.parse,
-                    errback=self.errback_httpbin
+                    errback=self.errback_httpbin,
+                    priority=int(total_items),
                 )
                 offset += limit
 
     def parse(self, response):
-        script_data = response.xpath('//div[contains(@class, "tracking-ddc-data-layer")]/script/text()').get()
-        script_data = script_data.split("DDC.dataLayer['vehicles'] = ")[1]
-        script_data = script_data.split(";\nDDC.dataLayer['confirmation']")[0]
-        script_data = re.sub(r'(?<=\w)\\-(?=\w)', '-', script_data)
-        script_data = re.sub(r'(?<=\w)\\x(?=\w)', '-', script_data)
-        script_data = json.loads(script_data)
-        #yield self.get_data(response)
-        data = response.xpath('//ul[contains(@class, "inventoryList")]/li[contains(@class, "item")]')
-        key = -1
-        for vehicle in data:
-            key += 1
-            yield self.get_data(response, vehicle, script_data[key])
-
-    def get_data(self,response,vehicle,script_data):
-        #data = response.xpath('//ul[contains(@class, "inventoryList")]/li[contains(@class, "item")]')
-        #for vehicle in data:
+        script_data = self.data_layer_vehicles(response)
+        cards = read_cards(response.selector.root)
+        self.dealer_stats(response, len(cards))
+        for card, vehicle in match_vehicles(cards, script_data, self.crawler.stats):
+            yield self.get_data(response, card, vehicle)
+
+    def data_layer_vehicles(self, response):
+        # The vehicles of DDC.dataLayer; without them the cards are still
+        # read from the HTML, only the fields the data layer adds stay empty
+        try:
+            vehicles = extract_assignment(response.body, "DDC.dataLayer['vehicles']")
+        except ValueError as e:
+            self.logger.warning(f"No DDC.dataLayer vehicles on {response.url}: {e}")
+            self.crawler.stats.inc_value('ddc/data_layer/missing')
+            return []
+        return vehicles if isinstance(vehicles, list) else []
+
+    def get_data(self, response, card, script_data):
         msrp = ''
         city_mpg = ''
         hw_mpg = ''
-        hproduct = vehicle.xpath('./div[contains(@class, "hproduct")]')
-        make = hproduct.xpath('./@data-make').get()
-        model = hproduct.xpath('./@data-model').get()
-        trim = hproduct.xpath('./@data-trim').get()
-        year = hproduct.xpath('./@data-year').get()
-        vin = hproduct.xpath('./@data-vin').get()
-        body_style = hproduct.xpath('./@data-bodystyle').get()
-        ext_color = hproduct.xpath('./@data-exteriorcolor').get()
-        image = hproduct.xpath('.//div[@class="media"]/a/img/@data-src').get()
-        if not image:
-            image = hproduct.xpath('.//div[@class="media"]/a/img/@src').get()
-        if (hproduct.xpath('.//span[contains(@class, "final-price")]/span[@class="value"]/text()').get()):
-            msrp = hproduct.xpath('.//span[contains(@class, "final-price")]/span[@class="value"]/text()').get().replace('$', "").replace(',', "")
-        description = hproduct.xpath('.//div[@class="description"]')
-        engine = description.xpath('//dt[contains(.,"Engine")]/following-sibling::dd/text()').get()
-        transmission = description.xpath('//dt[contains(.,"Transmission")]/following-sibling::dd/text()').get()
-        if (description.xpath('//dt[contains(.,"MPG Range")]/following-sibling::dd/text()').get()):
-            mpg = description.xpath('//dt[contains(.,"MPG Range")]/following-sibling::dd/text()').get().split('/')
+        make = card.data.get('make')
+        model = card.data.get('model')
+        trim = card.data.get('trim')
+        year = card.data.get('year')
+        vin = card.data.get('vin')
+        body_style = card.data.get('bodystyle')
+        ext_color = card.data.get('exteriorcolor')
+        image = card.image
+        if card.price:
+            msrp = card.price.replace('$', "").replace(',', "")
+        engine = card.spec("Engine")
+        transmission = card.spec("Transmission")
+        if card.spec("MPG Range"):
+            mpg = card.spec("MPG Range").split('/')
             city_mpg = mpg[0]
-            hw_mpg = mpg[1]
-        drive_type = description.xpath('//dt[contains(.,"Drive Line")]/following-sibling::dd/text()').get() or ""
-        int_color = description.xpath('//dt[contains(.,"Interior Color")]/following-sibling::dd/text()').get()
-        doors = script_data['doors']
-        if doors == 'null': doors = ""
+            hw_mpg = mpg[1] if len(mpg) > 1 else ''
+        drive_type = card.spec("Drive Line") or ""
+        int_color = card.spec("Interior Color")
+        doors = script_data.get('doors', '')
+        if doors is None or doors == 'null': doors = ""
 
         parsed_url = urlparse(response.url)
         source = parsed_url.netloc.replace('www.', '')
-        link = parsed_url.scheme + '://' + parsed_url.netloc + hproduct.xpath('//a[@class="url"]/@href').get()
-
-        return {
-            "Make": make,
-            "Model": model,
-            "Trim": trim,
-            "Year": str(year),
-            "VIN": vin,
-            "MSRP": str(msrp),
-            "FuelType": script_data['normalFuelType'],
-            "BodyStyle": body_style,
-            "Engine": engine,
-            "Transmission": transmission,
-            "ExteriorColor": ext_color,
-            "ExteriorColorGeneric": "",
-            "InteriorColor": int_color,
-            "InteriorColorGeneric": "",
-            "DriveTrain": drive_type,
-            "NumberOfDoors": str(doors),
-            "CityMPG": str(city_mpg),
-            "HighwayMPG": str(hw_mpg),
-            "Features": script_data['features'],
-            "Image": image,
-            "Link": link,
-            "Source": source,
-            "CollectedFrom": 'HTML DDC Content',
-            "Style": trim
-        }
+        link = parsed_url.scheme + '://' + parsed_url.netloc + (card.link or '')
+
+        return DealerListing(
+            Make=make,
+            Model=model,
+            Trim=trim,
+            Year=str(year),
+            VIN=vin,
+            MSRP=str(msrp),
+            FuelType=script_data.get('normalFuelType', ''),
+            BodyStyle=body_style,
+            Engine=engine,
+            Transmission=transmission,
+            ExteriorColor=ext_color,
+            ExteriorColorGeneric="",
+            InteriorColor=int_color,
+            InteriorColorGeneric="",
+            DriveTrain=drive_type,
+            NumberOfDoors=str(doors),
+            CityMPG=str(city_mpg),
+            HighwayMPG=str(hw_mpg),
+            Features=script_data.get('features', ''),
+            Image=image,
+            Link=link,
+            Source=source,
+            CollectedFrom='HTML DDC Content',
+            Style=trim
+        )
 
     def errback_httpbin(self, failure):
-        #repr(failure)
-        self.write_to_log(failure.request.url)
-
-    def write_to_log(self, url):
-        time = datetime.now()
-        time = time.strftime("%Y-%m-%d %H:%M:%S")
-        with open('failed_urls.log', mode='a') as file:
-            file.write(time + " - " + url + "\n")
+        self.dead_letters.add(failure.request, self, repr(failure.value))
@@ -1,6 +1,3 @@
-import json
-import re
-
 import playwright
 import scrapy
 from scrapy.crawler import CrawlerProcess
@@ -8,6 +5,9 @@ from scrapy.settings import Settings
 from scrapy_playwright.page import PageMethod
 import logging
 
+from scraper.deadletter import DeadLetterQueue, replay_requests
+from scraper.jsextract import extract_assignment
+
 class TestSpider(scrapy.Spider):
     name = "what-the-fuck"
     start_url = "https://www.ford.com/"
@@ -18,7 +18,16 @@ class TestSpider(scrapy.Spider):
         "Connection": "keep-alive"
     }
 
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.dead_letters = DeadLetterQueue.from_crawler(crawler, spider)
+        return spider
+
     def start_requests(self):
+        if getattr(self, "replay", None):
+            yield from replay_requests(self.replay, self)
+            return
         self.logger.info("Parse initial called")
         yield scrapy.Request(
             url='https://www.ford.com/fps/script/Ford/USA',
@@ -38,26 +47,16 @@ class TestSpider(scrapy.Spider):
         )
 
     def parse_json(self, response):
-        # Get the raw JavaScript content from the response
-        js_content = response.text
-
-        # Use regex to find the vdmActiveNameplates variable
-        pattern = r'var vdmActiveNameplates = ({.*?});'
-        match = re.search(pattern, js_content, re.DOTALL)
-
-        if match:
-            # Extract the JSON string
-            json_str = match.group(1)
-            try:
-                # Parse the JSON string into a Python dictionary
-                vdm_active_nameplates = json.loads(json_str)
-                self.logger.info(vdm_active_nameplates)
-                # Yield or process the JSON data as needed
-                yield {'vdmActiveNameplates': vdm_active_nameplates}
-            except json.JSONDecodeError as e:
-                self.logger.error(f"Failed to parse JSON: {e}")
-        else:
-            self.logger.error("Could not find vdmActiveNameplates in the response")
+        try:
+            # Scans from the assignment to its matching brace in one pass
+            vdm_active_nameplates = extract_assignment(response.body, "vdmActiveNameplates")
+        except ValueError as e:
+            self.logger.error(f"Could not extract vdmActiveNameplates from the response: {e}")
+            return
+        self.logger.info(vdm_active_nameplates)
+
+        # Yield or process the JSON data as needed
+        yield {'vdmActiveNameplates': vdm_active_nameplates}
 
     def parse_response(self, response):
         self.logger.info("Response body length: %d", len(response.text))
@@ -100,3 +99,4 @@ class TestSpider(scrapy.Spider):
         self.logger.error(f"Request failed: {failure}")
         if failure.check(playwright._impl._errors.Error):
             self.logger.error(f"Playwright error: {failure.value}")
+        self.dead_letters.add(failure.request, self, repr(failure.value))
@@ -1,4 +1,3 @@
-import copy
 import json
 import os
 from datetime import datetime
@@ -6,6 +5,100 @@ from datetime import datetime
 import scrapy
 from scrapy.crawler import CrawlerProcess
 
+from scraper.deadletter import DeadLetterQueue, replay_requests
+from scraper.decoding import SeriesListResponse, decode
+from scraper.graphql import REGISTRY, AliasedQuery, chunks
+from scraper.items import VehicleRecord
+
+LIST_SERIES_QUERY = REGISTRY.register("""
+    query GetSeries($brand: Brand!, $language: Language, $region: Region!) {
+        getSeries(brand: $brand, language: $language, region: $region) {
+            seriesData {
+                id
+                name
+                yearSpecificData {
+                    year
+                }
+            }
+        }
+    }
+""")
+
+SERIES_QUERY = AliasedQuery(
+    "GetSeries",
+    "getSeries",
+    shared={"brand": "Brand!", "language": "Language", "region": "Region!"},
+    per_alias={"seriesId": "String!", "year": "Int!"},
+    selection="""{
+        seriesData {
+            yearSpecificData {
+                grades {
+                    gradeName
+                    image {
+                        url
+                    }
+                    trims {
+                        code
+                        msrp {
+                            value
+                        }
+                        defaultConfig {
+                            msrp {
+                                value
+                            }
+                        }
+                        cabBed {
+                            bedLength
+                            label
+                            description
+                        }
+                        powertrain {
+                            drive {
+                                value
+                            }
+                            engine {
+                                value
+                            }
+                            transmission {
+                                value
+                            }
+                        }
+                        fuelType
+                    }
+                }
+            }
+        }
+    }""",
+)
+
+# FIXED QUERY: Removed the invalid msrp field from packages
+GRADE_QUERY = AliasedQuery(
+    "GetConfigByGrade",
+    "getConfigByGrade",
+    shared={},
+    per_alias={"configInputGrade": "ConfigInputGrade!"},
+    selection="""{
+        exteriorColors {
+            title
+            msrp { value }
+            hexCode
+        }
+        interiorColors {
+            name
+            msrp { value }
+            hexCode
+        }
+        categories {
+            value
+        }
+        packages {
+            id
+            title
+            description
+        }
+    }""",
+)
+
 
 class ToyotaSpider(scrapy.Spider):
     name = 'toyota'
@@ -21,61 +114,102 @@ class ToyotaSpider(scrapy.Spider):
     formatted_datetime = current_datetime.strftime('%Y-%m-%d_%H-%M-%S')
     filepath = f"output/toyota_{formatted_datetime}.csv"
 
+    flat_fields = [
+        "make", "model", "year", "trim", "msrp", "exteriorColors", "interiorColors",
+        "driveType", "transmissionType", "engineType", "fuelType", "bodyType", "cabType",
+        "bedLength", "packages", "url"
+    ]
+    # Columns of the normalized tables (see NormalizedOutputPipeline)
+    grade_fields = [
+        "grade_key", "make", "model", "year", "trim", "url", "bodyType",
+        "exteriorColors", "interiorColors", "packages"
+    ]
+    trim_fields = [
+        "grade_key", "code", "msrp", "driveType", "transmissionType", "engineType",
+        "fuelType", "cabType", "bedLength"
+    ]
+
     custom_settings = {
         "FEEDS": {
             filepath: {
                 "format": "csv",
-                "fields": [
-                    "make", "model", "year", "trim", "msrp", "exteriorColors", "interiorColors",
-                    "driveType", "transmissionType", "engineType", "fuelType", "bodyType", "cabType",
-                    "bedLength", "packages", "url"
-                ],
+                "fields": flat_fields,
             },
         },
-        "DOWNLOAD_DELAY": 1.5,
         "LOG_LEVEL": "INFO",
+        # The orchestrator endpoint's concurrency and delay are managed by
+        # AdaptiveRateMiddleware, starting from a 1.5s delay
+        "ADAPTIVE_RATE_ENABLED": True,
         "CONCURRENT_REQUESTS": 4,
+        "ADAPTIVE_RATE_START_DELAY": 1.5,
+        "ADAPTIVE_RATE_MAX_CONCURRENCY": 4,
         "RETRY_TIMES": 3,
         "RETRY_HTTP_CODES": [403, 429, 500, 502, 503, 504],
+        # Lookups merged into one aliased GraphQL document per POST
+        "TOYOTA_GRAPHQL_BATCH_SIZE": 20,
+        # Send query hashes instead of the query text (see PersistedQueryMiddleware)
+        "GRAPHQL_PERSISTED_QUERIES": True,
+        # "flat" writes one row per trim with the grade's colors/packages
+        # repeated; "normalized" writes a grade table and a trim table that
+        # references it, and derives the flat CSV from them at the end
+        "TOYOTA_OUTPUT_MODE": "flat",
+    }
+
+    shared_variables = {
+        "brand": "TOYOTA",
+        "language": "EN",
+        "region": {"zipCode": "33444"},
     }
 
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        if settings.get("TOYOTA_OUTPUT_MODE") == "normalized":
+            # The grade/trim tables replace the flat feed
+            settings.set("FEEDS", {}, priority="spider")
+            settings.set("ITEM_PIPELINES", {"scraper.pipelines.NormalizedOutputPipeline": 300}, priority="spider")
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
         self.logger.info(f"Output will be saved to: {self.filepath}")
 
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.dead_letters = DeadLetterQueue.from_crawler(crawler, spider)
+        return spider
+
+    @property
+    def batch_size(self):
+        return self.settings.getint("TOYOTA_GRAPHQL_BATCH_SIZE", 1)
+
     def start_requests(self):
-        body = {
-            "query": """
-                query GetSeries($brand: Brand!, $language: Language, $region: Region!) {
-                    getSeries(brand: $brand, language: $language, region: $region) {
-                        seriesData {
-                            id
-                            name
-                            yearSpecificData {
-                                year
-                            }
-                        }
-                    }
-                }
-            """,
-            "variables": {
-                "brand": "TOYOTA",
-                "language": "EN",
-                "region": {"zipCode": "33444"}
-            }
-        }
-        yield scrapy.Request(
+        if getattr(self, 'replay', None):
+            yield from replay_requests(self.replay, self)
+            return
+        yield self.graphql_request(LIST_SERIES_QUERY, self.shared_variables, callback=self.parse_series)
+
+    def graphql_request(self, query, variables, **kwargs):
+        persisted = self.settings.getbool("GRAPHQL_PERSISTED_QUERIES")
+        return scrapy.Request(
             url=self.url,
             method='POST',
-            body=json.dumps(body),
+            body=query.body(variables, persisted),
             headers=self.headers,
-            callback=self.parse_series
+            meta={'graphql_query': query.sha256, 'graphql_persisted': persisted},
+            errback=self.handle_error,
+            **kwargs
         )
 
+    def handle_error(self, failure):
+        # The request keeps its lookups, so a replay picks up right there
+        self.logger.error(f"Request failed: {failure}")
+        self.dead_letters.add(failure.request, self, repr(failure.value))
+
     def parse_series(self, response):
         try:
-            data = json.loads(response.text)
+            data = decode(response.body, SeriesListResponse)
             if 'errors' in data:
                 self.logger.error(f"API errors in series request: {data['errors']}")
                 return
@@ -83,6 +217,7 @@ class ToyotaSpider(scrapy.Spider):
             series_data = data.get('data', {}).get('getSeries', {}).get('seriesData', [])
             self.logger.info(f"Found {len(series_data)} vehicle series")
 
+            lookups = []
             for series in series_data:
                 series_id = series.get('id')
                 series_name = series.get('name')
@@ -95,88 +230,100 @@ class ToyotaSpider(scrapy.Spider):
                     self.logger.info(f"Processing {series_name} {year}")
 
                     # Create base model info
-                    model = {
-                        "make": "Toyota",
-                        "model": series_name,
-                        "year": year
-                    }
+                    model = VehicleRecord(make="Toyota", model=series_name, year=year)
+                    lookups.append({'model': model, 'seriesId': series_id, 'year': year})
 
-                    # Request grades and trims data
-                    body = {
-                        "query": """
-                            query GetSeries($brand: Brand!, $seriesId: String!, $year: Int!, $language: Language, $region: Region!) {
-                                getSeries(brand: $brand, seriesId: $seriesId, year: $year, language: $language, region: $region) {
-                                    seriesData {
-                                        yearSpecificData {
-                                            grades {
-                                                gradeName
-                                                image {
-                                                    url
-                                                }
-                                                trims {
-                                                    code
-                                                    msrp {
-                                                        value
-                                                    }
-                                                    defaultConfig {
-                                                        msrp {
-                                                            value
-                                                        }
-                                                    }
-                                                    cabBed {
-                                                        bedLength
-                                                        label
-                                                        description
-                                                    }
-                                                    powertrain {
-                                                        drive {
-                                                            value
-                                                        }
-                                                        engine {
-                                                            value
-                                                        }
-                                                        transmission {
-                                                            value
-                                                        }
-                                                    }
-                                                    fuelType
-                                                }
-                                            }
-                                        }
-                                    }
-                                }
-                            }
-                        """,
-                        "variables": {
-                            "brand": "TOYOTA",
-                            "language": "EN",
-                            "region": {"zipCode": "33444"},
-                            "seriesId": series_id,
-                            "year": year
-                        }
-                    }
-
-                    yield scrapy.Request(
-                        url=self.url,
-                        method='POST',
-                        body=json.dumps(body),
-                        headers=self.headers,
-                        callback=self.parse_trims_directly,
-                        cb_kwargs={'model': model, 'series_id': series_id}
-                    )
+            # Request grades and trims data, several series/years per POST
+            for batch in chunks(lookups, self.batch_size):
+                yield self.series_batch_request(batch)
         except Exception as e:
             self.logger.error(f"Error parsing series: {str(e)}", exc_info=True)
 
-    def parse_trims_directly(self, response, model, series_id):
-        try:
-            data = json.loads(response.text)
-            if 'errors' in data:
-                self.logger.error(f"API errors in trims request: {data['errors']}")
-                return
+    def series_batch_request(self, lookups):
+        return self.graphql_request(
+            SERIES_QUERY.query(len(lookups)),
+            SERIES_QUERY.variables(self.shared_variables, lookups),
+            callback=self.parse_series_batch,
+            cb_kwargs={'lookups': lookups},
+            dont_filter=True,
+        )
+
+    def grade_batch_request(self, lookups):
+        return self.graphql_request(
+            GRADE_QUERY.query(len(lookups)),
+            GRADE_QUERY.variables({}, lookups),
+            callback=self.parse_grades_batch,
+            cb_kwargs={'lookups': lookups},
+            dont_filter=True,
+        )
 
+    def count_batch(self, lookups, split=False):
+        # Requests saved against one request per lookup, counted once the
+        # batch is answered: a batch that had to be split cost one request
+        # more than sending its lookups one by one
+        stats = self.crawler.stats
+        if split:
+            stats.inc_value('toyota/graphql/batches_split')
+            stats.inc_value('toyota/graphql/requests_saved', -1)
+        else:
+            stats.inc_value('toyota/graphql/requests_saved', len(lookups) - 1)
+
+    def parse_series_batch(self, response, lookups):
+        try:
+            results = SERIES_QUERY.split(decode(response.body), len(lookups))
+        except Exception as e:
+            self.logger.error(f"Error parsing trims batch: {str(e)}", exc_info=True)
+            return
+        if len(lookups) > 1 and all(data is None for data, _ in results):
+            # Nothing came back for any alias, retry them one by one so a
+            # single bad lookup can't hold back the others
+            self.count_batch(lookups, split=True)
+            for lookup in lookups:
+                yield self.series_batch_request([lookup])
+            return
+        self.count_batch(lookups)
+
+        grade_lookups = []
+        for lookup, (series, errors) in zip(lookups, results):
+            if errors or series is None:
+                self.logger.error(f"API errors in trims request for {lookup['model'].model} {lookup['year']}: {errors}")
+                continue
+            grade_lookups.extend(self.parse_trims_directly(series, lookup['model'], lookup['seriesId']))
+
+        for batch in chunks(grade_lookups, self.batch_size):
+            yield self.grade_batch_request(batch)
+
+    def parse_grades_batch(self, response, lookups):
+        try:
+            results = GRADE_QUERY.split(decode(response.body), len(lookups))
+        except Exception as e:
+            self.logger.error(f"Error parsing colors/packages batch: {str(e)}", exc_info=True)
+            return
+        if len(lookups) > 1 and all(data is None for data, _ in results):
+            self.count_batch(lookups, split=True)
+            for lookup in lookups:
+                yield self.grade_batch_request([lookup])
+            return
+        self.count_batch(lookups)
+
+        for lookup, (config, errors) in zip(lookups, results):
+            if errors or config is None:
+                self.logger.error(f"API errors in colors/packages request for {lookup['grade_name']}: {errors}")
+                continue
+            yield from self.parse_colors_packages(
+                config,
+                base_model=lookup['base_model'],
+                grade_name=lookup['grade_name'],
+                grade_image_url=lookup['grade_image_url'],
+                trims=lookup['trims'],
+            )
+
+    def parse_trims_directly(self, series, model, series_id):
+        # Returns the colors/packages lookups for every grade of one series/year
+        lookups = []
+        try:
             # Find all trims across all grades
-            year_data = \
-            data.get('data', {}).get('getSeries', {}).get('seriesData', [{}])[0].get('yearSpecificData', [{}])[0]
+            year_data = series.get('seriesData', [{}])[0].get('yearSpecificData', [{}])[0]
 
             for grade in year_data.get('grades', []):
                 if grade is None:
@@ -192,76 +339,33 @@ class ToyotaSpider(scrapy.Spider):
 
                 self.logger.info(f"Processing grade: {grade_name}")
 
-                # Now get detailed information for colors and packages
-                # FIXED QUERY: Removed the invalid msrp field from packages
-                body = {
-                    "query": """
-                        query GetConfigByGrade($configInputGrade: ConfigInputGrade!) {
-                            getConfigByGrade(configInputGrade: $configInputGrade) {
-                                exteriorColors {
-                                    title
-                                    msrp { value }
-                                    hexCode
-                                }
-                                interiorColors {
-                                    name
-                                    msrp { value }
-                                    hexCode
-                                }
-                                categories {
-                                    value
-                                }
-                                packages {
-                                    id
-                                    title
-                                    description
-                                }
-                            }
-                        }
-                    """,
-                    "variables": {
-                        "configInputGrade": {
-                            "brand": "TOYOTA",
-                            "language": "EN",
-                            "region": {"zipCode": "33444"},
-                            "seriesId": series_id,
-                            "year": model['year'],
-                            "gradeName": grade_name
-                        }
-                    }
-                }
-
                 # Process each trim within this grade now
                 trims = grade.get('trims', [])
                 self.logger.info(f"Found {len(trims)} trims for {grade_name}")
 
                 if trims:
-                    yield scrapy.Request(
-                        url=self.url,
-                        method='POST',
-                        body=json.dumps(body),
-                        headers=self.headers,
-                        callback=self.parse_colors_packages,
-                        cb_kwargs={
-                            'base_model': model,
-                            'grade_name': grade_name,
-                            'grade_image_url': grade_image_url,
-                            'trims': trims
-                        }
-                    )
+                    # Now get detailed information for colors and packages
+                    lookups.append({
+                        'configInputGrade': {
+                            "brand": "TOYOTA",
+                            "language": "EN",
+                            "region": {"zipCode": "33444"},
+                            "seriesId": series_id,
+                            "year": model.year,
+                            "gradeName": grade_name
+                        },
+                        'base_model': model,
+                        'grade_name': grade_name,
+                        'grade_image_url': grade_image_url,
+                        'trims': trims
+                    })
 
         except Exception as e:
             self.logger.error(f"Error parsing trims directly: {str(e)}", exc_info=True)
+        return lookups
 
-    def parse_colors_packages(self, response, base_model, grade_name, grade_image_url, trims):
+    def parse_colors_packages(self, config, base_model, grade_name, grade_image_url, trims):
         try:
-            data = json.loads(response.text)
-            if 'errors' in data:
-                self.logger.error(f"API errors in colors/packages request: {data['errors']}")
-                return
-
-            config = data.get('data', {}).get('getConfigByGrade', {})
-
             # Extract common data (colors, packages, body type)
             exterior_colors = []
             for c in config.get('exteriorColors', []):
@@ -318,19 +422,29 @@ class ToyotaSpider(scrapy.Spider):
                     'description': p.get('description', '')
                 })
 
+            # The colors and packages are shared by every trim of the grade,
+            # so they are serialised once here
+            grade = base_model.replace(
+                trim=grade_name,
+                url=grade_image_url,
+                exteriorColors=json.dumps(exterior_colors),
+                interiorColors=json.dumps(interior_colors),
+                bodyType=body_type,
+                packages=json.dumps(all_packages) if all_packages else ""
+            )
+            normalized = self.settings.get("TOYOTA_OUTPUT_MODE") == "normalized"
+            if normalized:
+                grade_key = f"{base_model.model}|{base_model.year}|{grade_name}"
+                yield {"record_type": "grade", "grade_key": grade_key, **grade.asdict()}
+
             # Process each trim with the common data
             for trim in trims:
                 if trim is None:
                     continue
 
-                # Create a separate model for each trim
-                trim_model = copy.deepcopy(base_model)
-                trim_model.update({
-                    "trim": grade_name,
-                    "url": grade_image_url,
-                    "exteriorColors": json.dumps(exterior_colors),
-                    "interiorColors": json.dumps(interior_colors),
-                    "bodyType": body_type,
+                # Only the trim-specific fields, the grade fields are added
+                # below (flat) or referenced by key (normalized)
+                trim_model = {
                     "engineType": "",
                     "driveType": "",
                     "transmissionType": "",
@@ -338,8 +452,7 @@ class ToyotaSpider(scrapy.Spider):
                     "cabType": "",
                     "bedLength": "",
                     "msrp": "",
-                    "packages": json.dumps(all_packages) if all_packages else ""
-                })
+                }
 
                 # Extract trim-specific info
                 trim_code = trim.get('code', '')
@@ -401,7 +514,11 @@ class ToyotaSpider(scrapy.Spider):
                     else:
                         trim_model['transmissionType'] = "Automatic"  # Default
 
-                yield trim_model
+                if normalized:
+                    trim_model.update({"record_type": "trim", "grade_key": grade_key, "code": trim_code})
+                    yield trim_model
+                else:
+                    yield grade.replace(**trim_model)
 
         except Exception as e:
             self.logger.error(f"Error parsing colors and packages: {str(e)}", exc_info=True)
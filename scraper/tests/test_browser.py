@@ -0,0 +1,30 @@
+from scrapy import Spider, signals
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from scraper.browser import LaunchProfileStats
+
+
+def test_launch_profile_page_stats():
+    crawler = get_crawler(Spider, {"PLAYWRIGHT_LAUNCH_PROFILE": "lean"})
+    ext = LaunchProfileStats.from_crawler(crawler)
+    spider = Spider("test")
+    send = crawler.signals.send_catch_log
+    send(signals.spider_opened, spider=spider)
+    for url in ("https://example.com/a", "https://example.com/b"):
+        request = Request(url, meta={"playwright": True})
+        send(signals.request_reached_downloader, request=request, spider=spider)
+        response = HtmlResponse(url, body=b"<html></html>", request=request)
+        send(signals.response_received, response=response, request=request, spider=spider)
+    # Plain HTTP requests aren't counted
+    request = Request("https://example.com/c")
+    send(signals.request_reached_downloader, request=request, spider=spider)
+    send(signals.response_received, response=HtmlResponse(request.url, request=request), request=request, spider=spider)
+    send(signals.spider_closed, spider=spider, reason="finished")
+
+    stats = crawler.stats.get_stats()
+    assert stats["playwright/launch_profile"] == "lean"
+    assert stats["playwright/profile/lean/page_count"] == 2
+    for key in ("startup_ms", "page_ms_total", "page_ms_max", "page_ms_avg"):
+        assert f"playwright/profile/lean/{key}" in stats
+    assert ext.started
@@ -0,0 +1,38 @@
+from scraper.configurator import extract_from_json
+
+
+def state(**props):
+    return {"props": {"pageProps": props}}
+
+
+def test_option_lists_are_extracted():
+    payload = state(
+        vehicle={
+            "exteriorColors": [
+                {"name": "Summit White", "msrp": {"value": 0}, "swatchUrl": "white.png"},
+                {"name": "Black", "msrp": {"value": 495}, "swatchUrl": "black.png"},
+            ],
+            "packages": [{"title": "Sport Package", "price": "$1,295", "features": [{"name": "Spoiler"}, "Wheels"]}],
+        }
+    )
+    assert extract_from_json([payload], "exterior") == [
+        {"image_url": "white.png", "name": "Summit White", "price": "0"},
+        {"image_url": "black.png", "name": "Black", "price": "495"},
+    ]
+    assert extract_from_json([payload], "options") == [
+        {"title": "Sport Package", "options": ["Spoiler", "Wheels"], "price": "$1,295"},
+    ]
+    assert extract_from_json([payload], "interior") == []
+
+
+def test_decoy_payload_is_not_a_hit():
+    # Keys that only mention the page, and lists under the right key that
+    # aren't options, must not be mistaken for the page's data
+    decoy = state(
+        seo={"exteriorImages": [{"name": "Front view", "url": "front.jpg"}]},
+        navigation={"interior": {"links": [{"title": "Interior", "href": "/interior"}]}},
+        packages=[{"title": "Compare packages"}],
+        paints="none",
+    )
+    for stage in ("exterior", "interior", "options"):
+        assert extract_from_json([decoy], stage) == []
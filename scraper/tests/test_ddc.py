@@ -0,0 +1,34 @@
+from scrapy.statscollectors import MemoryStatsCollector
+from scrapy.utils.test import get_crawler
+
+from scraper.ddc import VehicleCard, match_vehicles
+
+
+def card(vin=None):
+    return VehicleCard({"vin": vin} if vin else {}, None, None, None, {})
+
+
+def stats():
+    return MemoryStatsCollector(get_crawler())
+
+
+def test_match_by_vin():
+    collector = stats()
+    vehicles = [{"vin": "B", "doors": 2}, {"vin": "A", "doors": 4}]
+    pairs = match_vehicles([card("A"), card("B")], vehicles, collector)
+    assert [vehicle["doors"] for _, vehicle in pairs] == [4, 2]
+    assert collector.get_value("ddc/vin/unmatched") is None
+
+
+def test_unmatched_and_vinless_cards_get_nothing():
+    # Never another vehicle's data, even if one sits at the card's position
+    collector = stats()
+    vehicles = [{"vin": "A", "doors": 4}, {"vin": "B", "doors": 2}, {"vin": "C", "doors": 2}]
+    pairs = match_vehicles([card("X0"), card(), card("C")], vehicles, collector)
+    assert [vehicle for _, vehicle in pairs] == [{}, {}, {"vin": "C", "doors": 2}]
+    assert collector.get_value("ddc/vin/unmatched") == 2
+
+
+def test_positions_when_nothing_has_a_vin():
+    pairs = match_vehicles([card(), card()], [{"doors": 4}, "junk"])
+    assert [vehicle for _, vehicle in pairs] == [{"doors": 4}, {}]
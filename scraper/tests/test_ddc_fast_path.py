@@ -0,0 +1,128 @@
+# Runs the ddcContent spider against scraper.replay servers standing in for
+# dealer sites, one server (host) per dealer
+import csv
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from scraper import settings as project_settings
+from scraper.ddc import FastPathState, JsonInventorySource, _sample_page
+from scraper.replay import make_server, recording_name
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INDEX = "/new-inventory/index.htm"
+
+VEHICLE = {
+    "make": "Chevrolet",
+    "model": "Equinox",
+    "trim": "LT",
+    "year": 2025,
+    "vin": "3GNAXKEG0SL000001",
+    "bodyStyle": "SUV",
+    "link": "/new/Chevrolet/2025-Chevrolet-Equinox-1.htm",
+    "images": [{"uri": "https://example.com/1.jpg"}],
+    "pricing": {"retailPrice": "$32,195", "dprice": [{"value": "$31,005", "isFinalPrice": True}]},
+    "trackingData": {"doors": 4, "normalFuelType": "Gasoline", "features": "Heated seats"},
+    "attributes": [
+        {"name": "engine", "value": "1.5L Turbo"},
+        {"name": "transmission", "value": "Automatic"},
+        {"name": "exteriorColor", "value": "Summit White"},
+        {"name": "interiorColor", "value": "Jet Black"},
+        {"name": "driveLine", "value": "FWD"},
+        {"name": "fuelEconomy", "value": "26/31"},
+    ],
+}
+
+
+def record(directory, path, body):
+    with open(os.path.join(directory, recording_name(path)), "wb") as f:
+        f.write(body)
+
+
+@pytest.fixture
+def dealers(tmp_path):
+    # json: has the API; missing: 404 on the API; empty: API answers nothing
+    servers = {}
+    for name in ("json", "missing", "empty"):
+        directory = tmp_path / name
+        server = make_server(str(directory), port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers[name] = (server, str(directory), f"http://127.0.0.1:{server.server_address[1]}")
+    json_api = JsonInventorySource().url(servers["json"][2] + INDEX)
+    api_path = json_api[len(servers["json"][2]):]
+    record(servers["json"][1], api_path, json.dumps({"inventory": [VEHICLE], "pageInfo": {"totalCount": 1}}).encode())
+    record(servers["empty"][1], api_path, b"{}")
+    for name in ("missing", "empty"):
+        record(servers[name][1], INDEX, _sample_page(2).encode())
+    yield {name: origin for name, (_, _, origin) in servers.items()}
+    for server, _, _ in servers.values():
+        server.shutdown()
+        server.server_close()
+
+
+def downloader_middlewares():
+    # The project's, without the proxy: the replay servers are local
+    spider = load_spider()
+    middlewares = dict(project_settings.DOWNLOADER_MIDDLEWARES)
+    middlewares.update(spider.custom_settings.get("DOWNLOADER_MIDDLEWARES", {}))
+    middlewares["scraper.middlewares.ProxyMiddleware"] = None
+    return json.dumps(middlewares)
+
+
+def load_spider():
+    from scrapy.spiderloader import SpiderLoader
+    from scrapy.utils.project import get_project_settings
+
+    return SpiderLoader.from_settings(get_project_settings()).load("ddcContent")
+
+
+def crawl(tmp_path, urls):
+    dealers_file = tmp_path / "dealers.txt"
+    dealers_file.write_text("".join(f"{url}\n" for url in urls))
+    settings = {
+        "DDC_FAST_PATH_STATE": tmp_path / "fast_path.json",
+        "EXPORT_FILE": tmp_path / "inventory.csv",
+        "EXPORT_FORMAT": "csv",
+        "DEDUP_DIR": tmp_path / "dedup",
+        "DEAD_LETTER_DIR": tmp_path / "dead_letters",
+        "ROBOTSTXT_OBEY": False,
+        "DOWNLOADER_MIDDLEWARES": downloader_middlewares(),
+        "LOG_LEVEL": "WARNING",
+    }
+    command = [sys.executable, "-m", "scrapy", "crawl", "ddcContent", "-a", f"urls={dealers_file}"]
+    for name, value in settings.items():
+        command += ["-s", f"{name}={value}"]
+    subprocess.run(command, cwd=PROJECT_DIR, check=True, timeout=120)
+    with open(tmp_path / "inventory.csv", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    return rows, FastPathState(str(tmp_path / "fast_path.json"))
+
+
+def dealer(origin):
+    return origin.split("://", 1)[1]
+
+
+def test_json_hit_is_mapped_onto_a_listing(tmp_path, dealers):
+    rows, state = crawl(tmp_path, [dealers["json"] + INDEX])
+    assert rows == [{
+        "Make": "Chevrolet", "Model": "Equinox", "Trim": "LT", "Year": "2025", "VIN": "3GNAXKEG0SL000001",
+        "MSRP": "31005", "FuelType": "Gasoline", "BodyStyle": "SUV", "Engine": "1.5L Turbo",
+        "Transmission": "Automatic", "ExteriorColor": "Summit White", "ExteriorColorGeneric": "",
+        "InteriorColor": "Jet Black", "InteriorColorGeneric": "", "DriveTrain": "FWD", "NumberOfDoors": "4",
+        "CityMPG": "26", "HighwayMPG": "31", "Features": "Heated seats", "Image": "https://example.com/1.jpg",
+        "Link": dealers["json"] + "/new/Chevrolet/2025-Chevrolet-Equinox-1.htm", "Source": dealer(dealers["json"]),
+        "CollectedFrom": "JSON DDC Inventory", "Style": "LT",
+    }]
+    assert state.get(dealer(dealers["json"])) == "json"
+
+
+@pytest.mark.parametrize("name", ["missing", "empty"])
+def test_no_json_inventory_falls_back_to_html(tmp_path, dealers, name):
+    rows, state = crawl(tmp_path, [dealers[name] + INDEX])
+    assert [row["VIN"] for row in rows] == ["VIN00000000000000", "VIN00000000000001"]
+    assert {row["CollectedFrom"] for row in rows} == {"HTML DDC Content"}
+    assert state.get(dealer(dealers[name])) == "html"
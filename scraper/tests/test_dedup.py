@@ -0,0 +1,29 @@
+import pytest
+from scrapy.settings import Settings
+
+from scraper.dedup import DedupIndex
+
+
+def test_keys_are_per_run_by_default(tmp_path):
+    settings = Settings({"DEDUP_DIR": str(tmp_path)})
+    index = DedupIndex.from_settings(settings, "spider")
+    assert not index.check_and_add("VIN1")
+    assert index.check_and_add("VIN1")
+    index.close()
+    index = DedupIndex.from_settings(settings, "spider")
+    assert not index.check_and_add("VIN1")
+    index.close()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_persisting_needs_a_ttl(tmp_path):
+    settings = Settings({"DEDUP_DIR": str(tmp_path), "DEDUP_PERSIST": True})
+    with pytest.raises(ValueError):
+        DedupIndex.from_settings(settings, "spider")
+    settings.set("DEDUP_TTL_DAYS", 1)
+    index = DedupIndex.from_settings(settings, "spider")
+    index.check_and_add("VIN1")
+    index.close()
+    index = DedupIndex.from_settings(settings, "spider")
+    assert index.check_and_add("VIN1")
+    index.close()
@@ -0,0 +1,41 @@
+import csv
+import io
+
+from scraper.export import CsvBatchWriter, cell
+
+
+def test_csv_batches_match_csv_writer(tmp_path):
+    fields = ["Name", "Colors", "Note", "Price"]
+    shared = [{"name": 'Red "Hot"', "price": "$0"}]
+    rows = [
+        ["Plain", shared, None, 1],
+        ["With, comma", shared, 'say "hi"', 2.5],
+        ["Line\nbreak", [], "carriage\r\nreturn", None],
+        ["", {"a": "b,c"}, " padded ", 0],
+    ]
+    path = tmp_path / "out.csv"
+    writer = CsvBatchWriter(path, fields)
+    json_cache = {}
+    # Two batches, the second repeats values quoted in the first
+    for batch in (rows[:3], rows[1:]):
+        writer.write({field: [cell(row[i], json_cache) for row in batch] for i, field in enumerate(fields)})
+    writer.close()
+
+    expected = io.StringIO(newline="")
+    reference = csv.writer(expected)
+    reference.writerow(fields)
+    for row in rows[:3] + rows[1:]:
+        reference.writerow([cell(value) for value in row])
+    assert path.read_bytes().decode("utf-8") == expected.getvalue()
+    with open(path, encoding="utf-8", newline="") as f:
+        assert list(csv.reader(f))[1][2] == ""
+
+
+def test_single_empty_field_is_quoted(tmp_path):
+    path = tmp_path / "out.csv"
+    writer = CsvBatchWriter(path, ["Name"])
+    writer.write({"Name": ["", "a"]})
+    writer.close()
+    expected = io.StringIO(newline="")
+    csv.writer(expected).writerows([["Name"], [""], ["a"]])
+    assert path.read_bytes().decode("utf-8") == expected.getvalue()
@@ -0,0 +1,20 @@
+import pytest
+
+from scraper.jsextract import extract_assignment
+
+
+def test_single_quoted_strings_with_quotes():
+    body = b"""DDC.dataLayer['vehicles'] = [{'trim': 'LT \\"Redline\\"', 'note': 'say "hi"', 'it': 'it\\'s'}];"""
+    assert extract_assignment(body, "DDC.dataLayer['vehicles']") == [
+        {"trim": 'LT "Redline"', "note": 'say "hi"', "it": "it's"},
+    ]
+
+
+def test_js_only_escapes():
+    body = rb'var vdmActiveNameplates = {"tagline": "Built\x2dWild\-Off\'road", "end": "};"};'
+    assert extract_assignment(body, "vdmActiveNameplates") == {"tagline": "Built-Wild-Off'road", "end": "};"}
+
+
+def test_missing_assignment():
+    with pytest.raises(ValueError):
+        extract_assignment(b"var other = {};", "vdmActiveNameplates")